@@ -2,6 +2,7 @@ import streamlit as st
 import pandas as pd
 import os
 import time
+from itertools import chain
 from pathlib import Path
 from dotenv import load_dotenv
 import sys
@@ -13,7 +14,7 @@ sys.path.append(str(project_root))
 load_dotenv()
 
 try:
-    from src.rag import FASAEngine
+    from src.rag import get_engine
     from src.ingestion import IngestionPipeline
     from src.indexing import IndexingPipeline
 except ImportError as e:
@@ -105,7 +106,7 @@ if "rag_engine" not in st.session_state:
     with st.spinner("Booting FASA Neural Core..."):
         try:
             # A. Initialize Engines
-            st.session_state.rag_engine = FASAEngine()
+            st.session_state.rag_engine = get_engine()
             st.session_state.ingest_pipe = IngestionPipeline()
             st.session_state.index_pipe = IndexingPipeline()
             
@@ -179,22 +180,31 @@ if prompt := st.chat_input(input_placeholder):
     with st.chat_message("assistant"): # This line creates an empty "Avatar/Bubble" container in the UI
         # === MODE A: Standard Q&A ===
         if mode == "💬 Ask Q&A":
-            with st.spinner("Analyzing SOPs & Verifying Claims..."):
-                try:
-                    response_payload = st.session_state.rag_engine.query(prompt)
-                    answer = response_payload["answer"]
-                    sources = response_payload["sources"]
-                    
-                    # Display Answer
-                    st.markdown(answer)
-                    # Save Answer AND Sources to History
-                    st.session_state.messages.append({
-                        "role": "assistant", 
-                        "content": answer, 
-                        "sources": sources  # Saving this ensures the table persists
-                    })
-                except Exception as e:
-                    st.error(f"Error: {str(e)}")
+            try:
+                # Tokens are rendered as the LLM writes them; sources arrive first (after retrieval)
+                sources = []
+
+                def _answer_tokens():
+                    for event in st.session_state.rag_engine.stream_query(prompt):
+                        if event["event"] == "sources":
+                            sources.extend(event["data"])
+                        else:
+                            yield event["data"]
+
+                with st.spinner("Analyzing SOPs & Verifying Claims..."):
+                    stream = _answer_tokens()
+                    first_token = next(stream, "")
+
+                # Display Answer (spinner covers retrieval; the answer then renders progressively)
+                answer = st.write_stream(chain([first_token], stream))
+                # Save Answer AND Sources to History
+                st.session_state.messages.append({
+                    "role": "assistant", 
+                    "content": answer, 
+                    "sources": sources  # Saving this ensures the table persists
+                })
+            except Exception as e:
+                st.error(f"Error: {str(e)}")
         
         # === MODE B: SOP Search ===
         else:
@@ -23,7 +23,7 @@ load_dotenv()
 # --- 2. IMPORT MODULES ---
 try:
     # Adjust this import based on your actual folder structure
-    from src.rag import FASAEngine 
+    from src.rag import get_engine
 except ImportError:
     # Fallback for testing if module is missing, or stop
     st.error("Could not import FASA Engine. Please check your python path.")
@@ -50,7 +50,7 @@ st.markdown("""
 if "rag_engine" not in st.session_state:
     try:
         with st.spinner("Initializing FASA Engine..."):
-            st.session_state.rag_engine = FASAEngine()
+            st.session_state.rag_engine = get_engine()
     except Exception as e:
         st.error(f"Engine failed to load: {e}")
         st.stop()
@@ -92,6 +92,9 @@ def update_sop_status(file_name, new_status):
         payload={"status": status_str},
         points=scroll_filter
     )
+
+    # 4. Cached answers may cite (or miss) this SOP now: a new index version retires them
+    engine.db_manager.index_version.bump()
     
     # Optional: Count how many we updated (just for UI feedback)
     # This acts as a sanity check
@@ -134,6 +137,7 @@ def delete_sop_permanently(file_name):
             collection_name=collection_name,
             points_selector=rest_models.FilterSelector(filter=delete_filter)
         )
+        engine.db_manager.index_version.bump()
         return True
     except Exception as e:
         st.error(f"Delete failed: {e}")
@@ -0,0 +1,439 @@
+import os
+import re
+import dbm
+import json
+import time
+import zlib
+import struct
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from src.text_utils import normalize_text, fold_case
+
+# =================================================================================================
+
+# Anchored at the project root (not the CWD): the app, the admin page and the ingest scripts
+# must share one index version and one set of answer caches wherever they are started from
+CACHE_DIR = Path(os.getenv("FASA_CACHE_DIR", Path(__file__).resolve().parent.parent / ".fasa_cache"))
+ANSWER_DB = CACHE_DIR / "answers.sqlite"
+SEARCH_DB = CACHE_DIR / "search.sqlite"  # keyword search() results, same schema
+EMBED_DB = CACHE_DIR / "embeddings.dbm"
+
+
+class AnswerCache:
+    """
+    Persistent exact-match answer cache (SQLite).
+    Keyed by a hash of the normalized query; entries expire after `ttl` seconds
+    so answers eventually pick up SOP changes even without an explicit invalidate().
+    Values are zlib-compressed JSON; the file survives restarts and is shared by all workers.
+    """
+
+    def __init__(self, db_path: Optional[Path] = None, ttl: float = 3600.0):
+        self.db_path = Path(db_path or ANSWER_DB)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+
+        # One connection shared across threads (Streamlit/FastAPI workers), guarded by a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "key TEXT PRIMARY KEY, query TEXT, value TEXT, ts REAL)"
+        )
+        self._conn.commit()
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(normalized_query: str) -> str:
+        return hashlib.blake2b(normalized_query.encode("utf-8"), digest_size=16).hexdigest()
+
+    @staticmethod
+    def _encode(payload: Any) -> bytes:
+        return zlib.compress(json.dumps(payload).encode("utf-8"), 1)
+
+    @staticmethod
+    def _decode(value: bytes) -> Any:
+        return json.loads(zlib.decompress(value).decode("utf-8"))
+
+    def get(self, normalized_query: str) -> Optional[Any]:
+        """Returns the cached payload, or None on a miss / expired entry."""
+        key = self.make_key(normalized_query)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, ts FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or time.time() - row[1] >= self.ttl:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._decode(row[0])
+
+    def set(self, normalized_query: str, payload: Any):
+        key = self.make_key(normalized_query)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers (key, query, value, ts) VALUES (?, ?, ?, ?)",
+                (key, normalized_query, self._encode(payload), time.time())
+            )
+            self._conn.commit()
+
+    def recent(self, limit: int) -> List[Tuple[str, Any, float]]:
+        """Up to `limit` unexpired (query, payload, ts) entries, newest first (for warm starts)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT query, value, ts FROM answers WHERE ts > ? ORDER BY ts DESC LIMIT ?",
+                (time.time() - self.ttl, limit)
+            ).fetchall()
+        return [(query, self._decode(value), ts) for query, value, ts in rows]
+
+    def invalidate(self, pattern: Optional[str] = None) -> int:
+        """
+        Drops cached answers. With no pattern everything is cleared; otherwise only
+        queries matching the SQL LIKE pattern (e.g. '%deviation%') are removed.
+        Call this when a new SOP version is ingested or a status changes.
+        """
+        with self._lock:
+            if pattern is None:
+                cur = self._conn.execute("DELETE FROM answers")
+            else:
+                cur = self._conn.execute("DELETE FROM answers WHERE query LIKE ?", (pattern,))
+            self._conn.commit()
+        print(f">>> Cache {self.db_path.name} invalidated ({cur.rowcount} entries).")
+        return cur.rowcount
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class SemanticCache:
+    """
+    In-memory two-tier query cache.
+    Tier 1: exact match on the normalized query string.
+    Tier 2: cosine similarity of the query embedding against every cached query embedding
+            (one matrix-vector product); a hit needs similarity >= the threshold of the
+            matched entry's region.
+    Bounded by `max_size` (LRU eviction) and `ttl` seconds per entry.
+
+    Region thresholds start at `threshold` and are learned in put(): when a freshly answered
+    query lands near a cached one (similarity >= `min_threshold`), `agrees(old, new)` tells
+    whether the cached answer would have been fine. If so the region's threshold drops to that
+    similarity, otherwise it rises just above it. The new entry inherits the region's threshold.
+    """
+
+    def __init__(self, max_size: int = 512, ttl: float = 3600.0, threshold: float = 0.97,
+                 min_threshold: float = 0.90, margin: float = 0.005):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.min_threshold = min_threshold
+        self.margin = margin
+
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, list]" = OrderedDict()  # key -> [payload, ts, row]
+        self._embs: Optional[np.ndarray] = None  # (max_size, dim) L2-normalized, rows 0..n-1 in use
+        self._thr = np.full(max_size, threshold, dtype=np.float32)  # row -> region threshold
+        self._row_keys: List[str] = []           # row -> key
+
+    def get_exact(self, key: str) -> Optional[Any]:
+        """
+        Tier 1. Counts hits only: a miss here is not the query's outcome yet (the caller goes on
+        to the disk cache / get_similar(), and get_similar() is the one place misses are counted).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[1] >= self.ttl:
+                self._evict(key)
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def get_similar(self, embedding) -> Optional[Any]:
+        with self._lock:
+            n = len(self._row_keys)
+            if n == 0:
+                self.misses += 1
+                return None
+
+            q = np.array(embedding, dtype=np.float32)
+            q /= (np.linalg.norm(q) or 1.0)
+            sims = self._embs[:n] @ q
+            row = int(np.argmax(sims))
+            if sims[row] < self._thr[row]:
+                self.misses += 1
+                return None
+
+            key = self._row_keys[row]
+            entry = self._entries[key]
+            if time.time() - entry[1] >= self.ttl:
+                self._evict(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, embedding, payload: Any, ts: Optional[float] = None,
+            agrees: Optional[Callable[[Any, Any], bool]] = None):
+        """
+        Stores an entry; `ts` lets warm-started entries keep their original age.
+        With `agrees`, the nearest cached entry's region threshold is adapted first (see class doc).
+        """
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+            while len(self._entries) >= self.max_size:
+                self._evict(next(iter(self._entries)))
+                self.evictions += 1
+
+            vec = np.array(embedding, dtype=np.float32)
+            vec /= (np.linalg.norm(vec) or 1.0)
+            if self._embs is None:
+                self._embs = np.zeros((self.max_size, vec.shape[0]), dtype=np.float32)
+
+            threshold = self.threshold
+            if agrees is not None and self._row_keys:
+                threshold = self._adapt(vec, payload, agrees)
+
+            row = len(self._row_keys)
+            self._embs[row] = vec
+            self._thr[row] = threshold
+            self._row_keys.append(key)
+            self._entries[key] = [payload, time.time() if ts is None else ts, row]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._row_keys.clear()
+
+    def stats(self) -> dict:
+        """
+        Hits count both tiers; a miss is a get_similar() lookup that fell through to the RAG
+        pipeline (one per question). Questions served by the disk AnswerCache count there.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "size": len(self._entries)
+            }
+
+    def _adapt(self, vec: np.ndarray, payload: Any, agrees: Callable[[Any, Any], bool]) -> float:
+        """Updates the threshold of the region `vec` falls into and returns it. Lock must be held."""
+        n = len(self._row_keys)
+        sims = self._embs[:n] @ vec
+        row = int(np.argmax(sims))
+        sim = float(sims[row])
+        if sim < self.min_threshold:
+            return self.threshold  # new region
+
+        if agrees(self._entries[self._row_keys[row]][0], payload):
+            # The cached answer was good enough at this distance: serve it from here on
+            self._thr[row] = max(self.min_threshold, min(self._thr[row], sim))
+        else:
+            # Different answer this close: only much nearer queries may reuse it
+            self._thr[row] = min(1.0, max(self._thr[row], sim + self.margin))
+        return float(self._thr[row])
+
+    def _evict(self, key: str):
+        """Removes an entry; the last embedding row is moved into the freed slot. Lock must be held."""
+        row = self._entries.pop(key)[2]
+        last = len(self._row_keys) - 1
+        if row != last:
+            moved_key = self._row_keys[last]
+            self._embs[row] = self._embs[last]
+            self._thr[row] = self._thr[last]
+            self._row_keys[row] = moved_key
+            self._entries[moved_key][2] = row
+        self._row_keys.pop()
+
+
+class EmbeddingCache:
+    """
+    Query-embedding cache: in-memory LRU (`max_size` vectors) in front of a dbm file on disk.
+    Keyed by sha256(model_name + normalize_text(query)) so whitespace/case variants share a vector
+    and switching FASA_EMBED_MODEL never serves stale ones. Entries expire after `ttl` seconds.
+    Values are an 8-byte timestamp + float32 bytes; the dbm file is opened lazily on first access.
+    """
+
+    _TS = struct.Struct("<d")
+
+    def __init__(self, db_path: Optional[Path] = None, max_size: int = 4096, ttl: float = 7 * 86400.0):
+        self.db_path = Path(db_path or EMBED_DB)
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._lru: "OrderedDict[str, Tuple[float, List[float]]]" = OrderedDict()  # key -> (ts, vec)
+        self._db = None
+
+    @staticmethod
+    def make_key(text: str, model_name: str) -> str:
+        raw_key = f"{model_name}\x00{normalize_text(text)}"
+        return hashlib.sha256(raw_key.encode("utf-8")).hexdigest()
+
+    def _disk(self):
+        """Opens the dbm file on first use. Lock must be held."""
+        if self._db is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                self._db = dbm.open(str(self.db_path), "c")
+            except dbm.error as e:
+                # e.g. gdbm file locked by another process: degrade to memory-only
+                print(f"Embedding cache disk store unavailable ({e}); using memory only.")
+                self._db = {}
+        return self._db
+
+    def get(self, text: str, model_name: str) -> Optional[List[float]]:
+        key = self.make_key(text, model_name)
+        now = time.time()
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self._lru.move_to_end(key)
+                return entry[1]
+
+            raw = self._disk().get(key)
+            if raw is None:
+                return None
+            ts = self._TS.unpack_from(raw)[0]
+            if now - ts >= self.ttl:
+                return None
+            vec = np.frombuffer(raw, dtype=np.float32, offset=self._TS.size).tolist()
+            self._remember(key, ts, vec)
+            return vec
+
+    def set(self, text: str, model_name: str, embedding: List[float]):
+        key = self.make_key(text, model_name)
+        vec = list(embedding)
+        ts = time.time()
+        with self._lock:
+            db = self._disk()
+            db[key] = self._TS.pack(ts) + np.asarray(vec, dtype=np.float32).tobytes()
+            if hasattr(db, "sync"):
+                db.sync()
+            self._remember(key, ts, vec)
+
+    def get_query_embedding(self, embed_model, text: str) -> List[float]:
+        """Cached wrapper around embed_model.get_query_embedding(text)."""
+        vec = self.get(text, embed_model.model_name)
+        if vec is None:
+            vec = embed_model.get_query_embedding(text)
+            self.set(text, embed_model.model_name, vec)
+        return vec
+
+    async def aget_query_embedding(self, embed_model, text: str) -> List[float]:
+        """Async variant of get_query_embedding()."""
+        vec = self.get(text, embed_model.model_name)
+        if vec is None:
+            vec = await embed_model.aget_query_embedding(text)
+            self.set(text, embed_model.model_name, vec)
+        return vec
+
+    def _remember(self, key: str, ts: float, vec: List[float]):
+        """Inserts into the in-memory LRU, evicting the oldest entry. Lock must be held."""
+        self._lru[key] = (ts, vec)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+
+class CorpusVocabulary:
+    """
+    Every lowercased word token (\\w+) of one collection's indexed SOP text, held in memory and
+    tagged with the IndexVersion it was scanned at. It only answers for that version, so it can
+    prove that a search term appears nowhere in the corpus but never hides a hit indexed later.
+    """
+
+    _WORD_RE = re.compile(r"\w+")
+
+    def __init__(self):
+        # (index version, tokens), swapped as one object so readers never mix two scans
+        self._snapshot: Tuple[Optional[int], frozenset] = (None, frozenset())
+
+    @property
+    def version(self) -> Optional[int]:
+        return self._snapshot[0]
+
+    @classmethod
+    def tokenize(cls, texts: Iterable[str]) -> set:
+        tokens = set()
+        for text in texts:
+            tokens.update(cls._WORD_RE.findall(fold_case(text)))
+        return tokens
+
+    def build(self, texts: Iterable[str], version: int):
+        """
+        Replaces the vocabulary with the tokens of `texts` (full corpus scan).
+        `version` must be read BEFORE the scan starts: a write during the scan bumps it past this one.
+        """
+        tokens = frozenset(self.tokenize(texts))
+        self._snapshot = (version, tokens)
+        print(f">>> Corpus vocabulary built ({len(tokens)} tokens, index v{version}).")
+
+    def contains_any(self, terms: Iterable[str], version: int) -> bool:
+        """False only when we KNOW none of the terms occurs in the corpus at index `version`."""
+        built_at, tokens = self._snapshot
+        if built_at != version:
+            return True
+        for term in terms:
+            # Terms with non-word characters can't be checked against \w+ tokens
+            if term in tokens or not self._WORD_RE.fullmatch(term):
+                return True
+        return False
+
+
+class IndexVersion:
+    """
+    Monotonic counter of index changes (upserts, status changes, deletes), stored in the SQLite
+    answer cache DB so the indexing pipeline, the admin dashboard and every engine process see
+    the same value. It is part of every answer cache key: after a bump, older entries are simply
+    never looked up. bump() is one SQL upsert, so concurrent bumps from several processes are
+    serialized by SQLite's write lock and none is lost.
+    """
+
+    def __init__(self, db_path: Optional[Path] = None):
+        self.db_path = Path(db_path or ANSWER_DB)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # One connection shared across threads, guarded by a lock (as in AnswerCache)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), timeout=30.0, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)"
+        )
+        self._conn.commit()
+
+    def get(self) -> int:
+        """Current version (0 before the first bump)."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'index_version'"
+            ).fetchone()
+        return row[0] if row else 0
+
+    def bump(self) -> int:
+        """Increments the version atomically (across threads and processes) and returns it."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('index_version', 1) "
+                "ON CONFLICT(key) DO UPDATE SET value = value + 1"
+            )
+            # Still inside the write transaction: reads our own increment
+            value = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'index_version'"
+            ).fetchone()[0]
+            self._conn.commit()
+        return value
@@ -29,4 +29,5 @@ class IndexingPipeline:
         if not nodes:
             print("Indexing Pipeline received empty node list. Skipping.")
             return None
+        # insert_nodes() bumps the index version, which retires every cached answer/search
         return self.db_manager.insert_nodes(nodes)
\ No newline at end of file
@@ -13,6 +13,10 @@ from llama_index.core import Settings
 RUNPOD_URL = "http://213.173.110.198:20332"
 # Port: 11434 (TCP)
 
+# Embedding model tag served by Ollama. Point this at a quantized tag (e.g. a q8_0 build)
+# to cut query-time embedding cost; re-index afterwards so stored vectors match.
+EMBED_MODEL_NAME = os.getenv("FASA_EMBED_MODEL", "nomic-embed-text-v2-moe")
+
 # =================================================================================================
 
 class EmbeddingManager:
@@ -21,10 +25,10 @@ class EmbeddingManager:
     """
     
     @staticmethod #ollama pull nomic-embed-text-v2-moe / nomic-embed-text
-    def get_embedding_model(model_name: str = "nomic-embed-text-v2-moe") -> OllamaEmbedding:
+    def get_embedding_model(model_name: str = EMBED_MODEL_NAME) -> OllamaEmbedding:
         """
         Instantiates the Ollama Embedding model.
-        Default is 'nomic-embed-text' (768 dimensions).
+        Default is 'nomic-embed-text' (768 dimensions), overridable via FASA_EMBED_MODEL.
         """
         # base_url = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
         base_url = RUNPOD_URL
@@ -1,18 +1,79 @@
 import os
-from typing import List, Optional
+from functools import lru_cache
+from typing import Iterator, List, Optional
+
+import numpy as np
 
 # --- LlamaIndex Imports ---
-from llama_index.core import VectorStoreIndex, StorageContext
-from llama_index.core.schema import TextNode
+from llama_index.core import VectorStoreIndex, StorageContext, Settings
+from llama_index.core.schema import TextNode, MetadataMode
+from llama_index.core.vector_stores.types import VectorStoreQueryResult
 from llama_index.vector_stores.qdrant import QdrantVectorStore
+from llama_index.vector_stores.qdrant.utils import fastembed_sparse_encoder
 
 # --- Qdrant Native Imports ---
-from qdrant_client import QdrantClient, models
+import httpx
+from qdrant_client import QdrantClient, AsyncQdrantClient, models
 from qdrant_client.models import VectorParams, Distance, SparseVectorParams
 from qdrant_client.http import models as rest_models  # Needed for Filters
 
+from src.cache import IndexVersion
+
 # =================================================================================================
 
+# Payload field with the full-text index used by the keyword search() prefilter
+TEXT_INDEX_FIELD = "original_text"
+
+# FastEmbed sparse model of the "text-sparse" vectors (documents and queries)
+SPARSE_MODEL = "Qdrant/bm25"
+
+def _min_max(scores: np.ndarray) -> np.ndarray:
+    """0..1 min-max scaling; a constant list keeps its value (as llama_index does)."""
+    lo, hi = scores.min(), scores.max()
+    if hi == lo:
+        return np.full_like(scores, hi)
+    return (scores - lo) / (hi - lo)
+
+
+def relative_score_fusion(
+    dense_result: VectorStoreQueryResult,
+    sparse_result: VectorStoreQueryResult,
+    alpha: float = 0.5,
+    top_k: int = 2
+) -> VectorStoreQueryResult:
+    """
+    NumPy version of llama_index's relative_score_fusion (QdrantVectorStore's default hybrid
+    fusion): same scores, same order (stable ties), same empty-leg behaviour. Each leg is
+    min-max scaled and fused as alpha * dense + (1 - alpha) * sparse in array ops instead of
+    per-node dict merges.
+    """
+    if not dense_result.nodes and not sparse_result.nodes:
+        return VectorStoreQueryResult(nodes=None, similarities=None, ids=None)
+    if not sparse_result.nodes:
+        return dense_result
+    if not dense_result.nodes:
+        return sparse_result
+
+    # Union of both legs, dense first (the order ties are broken in)
+    nodes = {n.node_id: n for n in dense_result.nodes}
+    for n in sparse_result.nodes:
+        nodes.setdefault(n.node_id, n)
+    slot = {node_id: i for i, node_id in enumerate(nodes)}
+    union = list(nodes.values())
+
+    fused = np.zeros(len(union), dtype=np.float64)
+    for result, weight in ((dense_result, alpha), (sparse_result, 1 - alpha)):
+        idx = np.fromiter((slot[n.node_id] for n in result.nodes), dtype=np.intp, count=len(result.nodes))
+        fused[idx] += weight * _min_max(np.asarray(result.similarities, dtype=np.float64))
+
+    order = np.argsort(-fused, kind="stable")[:top_k]
+    return VectorStoreQueryResult(
+        nodes=[union[i] for i in order],
+        similarities=fused[order].tolist(),
+        ids=[union[i].node_id for i in order],
+    )
+
+
 class QdrantManager:
     """
     Manages Qdrant Vector Database interactions.
@@ -25,29 +86,103 @@ class QdrantManager:
         # Nomic-embed-text is 768 dimensions
         self.vector_dim = 768 
 
+        # Bumped on every upsert / status change; part of the engine's answer cache keys
+        self.index_version = IndexVersion()
+
+        # Dense-vector quantization ("binary", "scalar" or "none"): the ANN stage scores compact
+        # vectors held in RAM, then rescores the oversampled top hits with the original float vectors.
+        self.quantization = os.getenv("QDRANT_QUANTIZATION", "binary").lower()
+        self.quantization_config = self._build_quantization_config(self.quantization)
+        self.search_params = (
+            models.SearchParams(
+                quantization=models.QuantizationSearchParams(rescore=True, oversampling=2.0)
+            )
+            if self.quantization_config is not None else None
+        )
+
+        # Optional server-side cosine cutoff for the dense leg of hybrid retrieval: Qdrant stops
+        # collecting points below it, so weak matches never reach the client. Unset = no cutoff
+        # (BM25 scores are unbounded, the sparse leg is never thresholded).
+        threshold = os.getenv("QDRANT_SCORE_THRESHOLD", "").strip()
+        self.score_threshold = float(threshold) if threshold else None
+
+        # Connection pool sized to the engine's concurrency (Streamlit sessions, query_batch).
+        # REST: explicit httpx limits, which also keep connections alive on localhost
+        # (qdrant-client turns keep-alive off there by default). gRPC: a channel pool of that size.
+        self.pool_size = int(os.getenv("QDRANT_POOL_SIZE", "64"))
+        self.prefer_grpc = os.getenv("QDRANT_PREFER_GRPC", "false").lower() in ("1", "true", "yes")
+        if self.prefer_grpc:
+            pool_kwargs = {"prefer_grpc": True, "pool_size": self.pool_size}
+        else:
+            pool_kwargs = {
+                "limits": httpx.Limits(
+                    max_connections=self.pool_size, max_keepalive_connections=self.pool_size
+                )
+            }
+
         # Initialize Native Client
         self.client = QdrantClient(
             url=self.url, 
-            timeout=30.0 
+            timeout=30.0,
+            **pool_kwargs
+        )
+
+        # Async Client: the ONE async connection pool of the process (shared engine), used by
+        # every retriever's aretrieve / aquery path and by the batch search
+        self.aclient = AsyncQdrantClient(
+            url=self.url,
+            timeout=30.0,
+            **pool_kwargs
         )
         
         # Check/Create Collection
         self.ensure_collection_exists()
         
+        # BM25 query encoder with an LRU in front (see encode_sparse_query); ours, so the store
+        # and the batch search share one memo without touching the store's internals
+        self.sparse_query_fn = self._cached_sparse_query_encoder(SPARSE_MODEL)
+
         # Initialize LlamaIndex Store
         self.vector_store = QdrantVectorStore(
             client=self.client,
+            aclient=self.aclient,
             collection_name=self.collection_name,
             batch_size=2, # Ollama can handle slightly larger batches locally
             enable_hybrid=True,
-            fastembed_sparse_model="Qdrant/bm25",
+            fastembed_sparse_model=SPARSE_MODEL,
+            sparse_query_fn=self.sparse_query_fn,
             dense_vector_name="text-dense",
             sparse_vector_name="text-sparse"
         )
-        
+
         self.storage_context = StorageContext.from_defaults(vector_store=self.vector_store)
 
 
+    @property
+    def async_client(self) -> AsyncQdrantClient:
+        return self.aclient
+
+    @staticmethod
+    def _build_quantization_config(mode: str):
+        """Maps QDRANT_QUANTIZATION to a Qdrant quantization config (None = full precision only)."""
+        if mode == "binary":
+            # 1 bit per dimension (32x smaller), Hamming distance on the server
+            return models.BinaryQuantization(
+                binary=models.BinaryQuantizationConfig(always_ram=True)
+            )
+        if mode == "scalar":
+            # int8 per dimension (4x smaller): the fallback when binary loses too much recall
+            return models.ScalarQuantization(
+                scalar=models.ScalarQuantizationConfig(
+                    type=models.ScalarType.INT8,
+                    quantile=0.99,
+                    always_ram=True
+                )
+            )
+        if mode not in ("none", ""):
+            print(f"Unknown QDRANT_QUANTIZATION '{mode}', using full-precision vectors.")
+        return None
+
     def ensure_collection_exists(self):
         """
         Creates the collection if it doesn't exist.
@@ -65,12 +200,15 @@ class QdrantManager:
                     },
                     sparse_vectors_config={
                         "text-sparse": SparseVectorParams()
-                    }
+                    },
+                    # Originals stay on disk for rescoring; only the quantized copy is pinned in RAM
+                    quantization_config=self.quantization_config
                 )
                 print(f"Collection '{self.collection_name}' created successfully.")
             except Exception as e:
                 print(f"Failed to create collection '{self.collection_name}': {e}")
                 raise e
+            self._ensure_text_index()
         else:
             # Simple validation to ensure we aren't writing to a mismatching schema
             info = self.client.get_collection(self.collection_name)
@@ -79,6 +217,55 @@ class QdrantManager:
                 print(f"Collection exists but has wrong dimensions! Expected {self.vector_dim}")
                 raise ValueError("Dimension mismatch in Qdrant. Please delete the collection and restart.")
 
+            # Existing collections: switch quantization on (or binary <-> scalar) in place;
+            # Qdrant re-quantizes in the background
+            current = info.config.quantization_config
+            if self.quantization_config is not None and type(current) is not type(self.quantization_config):
+                print(f"Enabling {self.quantization} quantization on '{self.collection_name}'...")
+                self.client.update_collection(
+                    collection_name=self.collection_name,
+                    quantization_config=self.quantization_config
+                )
+
+            if TEXT_INDEX_FIELD not in (info.payload_schema or {}):
+                self._ensure_text_index()
+
+    def _ensure_text_index(self):
+        """
+        Full-text (inverted) payload index on the chunk text, so MatchText keyword filters
+        run server-side against an index instead of scanning payloads.
+        """
+        print(f"Creating full-text index on '{TEXT_INDEX_FIELD}'...")
+        try:
+            self.client.create_payload_index(
+                collection_name=self.collection_name,
+                field_name=TEXT_INDEX_FIELD,
+                field_schema=models.TextIndexParams(
+                    type=models.TextIndexType.TEXT,
+                    tokenizer=models.TokenizerType.WORD,
+                    lowercase=True
+                )
+            )
+        except Exception as e:
+            # Not fatal: MatchText still works without the index, just slower
+            print(f"Failed to create full-text index: {e}")
+
+    @staticmethod
+    def keyword_filter(terms: List[str]) -> rest_models.Filter:
+        """
+        Active chunks whose text contains AT LEAST ONE of the terms (OR logic, whole words).
+        One MatchText per term: a multi-word MatchText would require all words.
+        """
+        return rest_models.Filter(
+            must=[
+                rest_models.FieldCondition(key="status", match=rest_models.MatchValue(value="Active"))
+            ],
+            should=[
+                rest_models.FieldCondition(key=TEXT_INDEX_FIELD, match=rest_models.MatchText(text=term))
+                for term in terms
+            ]
+        )
+
 
     
     # --- UPDATED: HELPER TO UPDATE STATUS IN DB ---
@@ -105,6 +292,7 @@ class QdrantManager:
                 ]
             )
         )
+        self.index_version.bump()
 
     # # --- NEW: HELPER TO UPDATE STATUS IN DB ---
     # def _set_db_status_inactive(self, file_name: str):
@@ -226,6 +414,158 @@ class QdrantManager:
 
 
 
+    # --- NEW: BM25 QUERY ENCODING, OVERLAPPABLE WITH THE DENSE EMBEDDING ---
+    @staticmethod
+    def _cached_sparse_query_encoder(model_name: str, maxsize: int = 1024):
+        """
+        The same FastEmbed encoder the store would build for queries, behind an LRU. The hybrid
+        query sends both legs in ONE query_batch_points call, but encodes the sparse vector first,
+        after the Ollama embedding. With the memo, encode_sparse_query() can run ahead on another
+        thread and the store reuses it. Cached as tuples; every caller gets fresh lists.
+        """
+        encode = fastembed_sparse_encoder(model_name=model_name)
+
+        @lru_cache(maxsize=maxsize)
+        def _encode(texts: tuple) -> tuple:
+            indices, values = encode(list(texts))
+            return tuple(map(tuple, indices)), tuple(map(tuple, values))
+
+        def sparse_query_fn(texts: List[str]):
+            indices, values = _encode(tuple(texts))
+            return [list(i) for i in indices], [list(v) for v in values]
+
+        return sparse_query_fn
+
+    def encode_sparse_query(self, query_str: str):
+        """Pre-computes (and memoizes) the BM25 query vector for `query_str`."""
+        self.sparse_query_fn([query_str])
+
+    # --- NEW: SERVER-SIDE HYBRID SEARCH (engine retriever + query_batch) ---
+    @staticmethod
+    def active_filter() -> rest_models.Filter:
+        """Native equivalent of the engine's status == 'Active' MetadataFilters."""
+        return rest_models.Filter(
+            must=[
+                rest_models.FieldCondition(key="status", match=rest_models.MatchValue(value="Active"))
+            ]
+        )
+
+    def _hybrid_requests(
+        self,
+        query_strs: List[str],
+        embeddings: List[List[float]],
+        top_k: int,
+        query_filter: Optional[rest_models.Filter]
+    ) -> List[rest_models.QueryRequest]:
+        """A dense + a sparse QueryRequest per query (BM25 vectors encoded in one call)."""
+        store = self.vector_store
+        sparse_indices, sparse_values = self.sparse_query_fn(query_strs)
+
+        requests = []
+        for embedding, indices, values in zip(embeddings, sparse_indices, sparse_values):
+            requests.append(rest_models.QueryRequest(
+                query=embedding, using=store.dense_vector_name, limit=top_k,
+                filter=query_filter, with_payload=True, params=self.search_params,
+                score_threshold=self.score_threshold
+            ))
+            requests.append(rest_models.QueryRequest(
+                query=rest_models.SparseVector(indices=indices, values=values),
+                using=store.sparse_vector_name, limit=top_k,
+                filter=query_filter, with_payload=True, params=self.search_params
+            ))
+        return requests
+
+    def _fuse(self, responses, top_k: int, alpha: float) -> List[VectorStoreQueryResult]:
+        """Fuses each (dense, sparse) response pair (vectorized relative score fusion)."""
+        store = self.vector_store
+        return [
+            relative_score_fusion(
+                store.parse_to_query_result(dense.points),
+                store.parse_to_query_result(sparse.points),
+                alpha=alpha,
+                top_k=top_k
+            )
+            for dense, sparse in zip(responses[0::2], responses[1::2])
+        ]
+
+    def hybrid_query_batch(
+        self,
+        query_strs: List[str],
+        embeddings: List[List[float]],
+        top_k: int,
+        alpha: float,
+        query_filter: Optional[rest_models.Filter] = None
+    ) -> List[VectorStoreQueryResult]:
+        """Sync variant of ahybrid_query_batch()."""
+        responses = self.client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=self._hybrid_requests(query_strs, embeddings, top_k, query_filter)
+        )
+        return self._fuse(responses, top_k, alpha)
+
+    async def ahybrid_query_batch(
+        self,
+        query_strs: List[str],
+        embeddings: List[List[float]],
+        top_k: int,
+        alpha: float,
+        query_filter: Optional[rest_models.Filter] = None
+    ) -> List[VectorStoreQueryResult]:
+        """
+        Hybrid retrieval for several queries in ONE query_batch_points round-trip
+        (a dense + a sparse request per query). Each pair is fused like the store's default
+        hybrid mode (relative score fusion), so scores match its single-query hybrid search.
+        """
+        responses = await self.aclient.query_batch_points(
+            collection_name=self.collection_name,
+            requests=self._hybrid_requests(query_strs, embeddings, top_k, query_filter)
+        )
+        return self._fuse(responses, top_k, alpha)
+
+    # --- NEW: CORPUS SCAN (used to build the search vocabulary) ---
+    def iter_chunk_texts(self, batch_size: int = 256) -> Iterator[str]:
+        """
+        Yields the searchable text of every stored chunk ('_scan', else 'original_text').
+        Payload-only scroll: vectors are not transferred.
+        """
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                limit=batch_size,
+                offset=offset,
+                with_payload=["_scan", "original_text"],
+                with_vectors=False
+            )
+            for point in points:
+                payload = point.payload or {}
+                text = payload.get("_scan") or payload.get("original_text")
+                if text:
+                    yield text
+            if offset is None:
+                break
+
+    # --- NEW: INGEST-TIME TEXT RESTORE ---
+    @staticmethod
+    def _embed_and_restore_text(nodes: List[TextNode]):
+        """
+        Computes dense embeddings from the lowercase chunk text, then replaces
+        node.text with metadata['original_text'] (cased, with 'Source:' header).
+        VectorStoreIndex reuses the precomputed embeddings on insert.
+        """
+        pending = [n for n in nodes if n.embedding is None]
+        if pending:
+            embeddings = Settings.embed_model.get_text_embedding_batch(
+                [n.get_content(metadata_mode=MetadataMode.EMBED) for n in pending]
+            )
+            for node, embedding in zip(pending, embeddings):
+                node.embedding = embedding
+
+        for node in nodes:
+            original_text = node.metadata.get("original_text")
+            if original_text:
+                node.text = original_text
+
     # --- UPDATED: INSERT METHOD ---
     def insert_nodes(self, nodes: List[TextNode]) -> Optional[VectorStoreIndex]:
         if not nodes:
@@ -258,6 +598,11 @@ class QdrantManager:
         for node in nodes:
             node.metadata["status"] = determined_status
 
+        # 3b. STORE DISPLAY TEXT
+        # Embed the lowercase search text now, then store the original text as the
+        # node text, so the query path no longer has to swap it back per result.
+        self._embed_and_restore_text(nodes)
+
         # 4. INSERT
         try:
             print(f">>> Indexing {len(nodes)} nodes for '{doc_num}: {sop_title}' as '{determined_status}'...")
@@ -265,6 +610,8 @@ class QdrantManager:
                 nodes, 
                 storage_context=self.storage_context
             )
+            # Cached answers keyed on the previous version are no longer served
+            self.index_version.bump()
             print(">>> Indexing Complete.")
             return index
             
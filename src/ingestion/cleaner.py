@@ -2,55 +2,71 @@ import re
 import fitz
 import os
 
-def clean_text(text: str) -> str:
-    """
-    Applies Regex cleaning rules to remove noise (headers, footers, pagination).
-    """
-    noise_patterns = [
+# --- PRECOMPILED CLEANING RULES (compiled once at import, reused for every page) ---
+_NOISE_RES = [
+    re.compile(pattern, re.IGNORECASE | re.MULTILINE)
+    for pattern in (
         r"_n_", 
         r"GRUNENTHAL",
         r"^\s*page\s*$" 
-    ]
-    for pattern in noise_patterns:
-        text = re.sub(pattern, "", text, flags=re.IGNORECASE | re.MULTILINE)
-    
-    header_keywords = [
-        r"Number:.*", 
-        r"Nummer:.*", 
-        r"Numero:.*", 
-        r"Número:.*", 
-        r"Revision:.*", 
-        r"Revisione:.*", 
-        r"Revisão:.*", 
-        r"Revisión:.*", 
-        r"Status:.*", 
-        r"Estado:.*", 
-        r"Effective Date:.*",
-        r"Data Effettiva:.*",
-        r"Data Efetiva:.*",
-        r"Fecha efectiva:.*",
-        r"Gültigkeitsdatum:.*",
-        r"Document No:.*",
-        r"Local Title:.*",
-        r"Lokaler Titel:.*",
-        r"Titolo locale:.*",
-        r"Título Local:.*",
-        r"Release.*"
-    ]
-    for pattern in header_keywords:
-        text = re.sub(pattern, "", text, flags=re.IGNORECASE)
-    
-    footer_patterns = [
+    )
+]
+
+_HEADER_KEYWORDS = [
+    r"Number:", 
+    r"Nummer:", 
+    r"Numero:", 
+    r"Número:", 
+    r"Revision:", 
+    r"Revisione:", 
+    r"Revisão:", 
+    r"Revisión:", 
+    r"Status:", 
+    r"Estado:", 
+    r"Effective Date:",
+    r"Data Effettiva:",
+    r"Data Efetiva:",
+    r"Fecha efectiva:",
+    r"Gültigkeitsdatum:",
+    r"Document No:",
+    r"Local Title:",
+    r"Lokaler Titel:",
+    r"Titolo locale:",
+    r"Título Local:",
+    r"Release"
+]
+# Every header rule drops from its keyword to the end of the line, so one alternation
+# (leftmost keyword wins) removes exactly what the rules did one after another
+_HEADER_RE = re.compile(rf"(?:{'|'.join(_HEADER_KEYWORDS)}).*", re.IGNORECASE)
+
+_FOOTER_RES = [
+    re.compile(pattern, re.DOTALL | re.IGNORECASE)
+    for pattern in (
         r"(This is an uncontrolled copy valid for.*)",
         r"(Page \d+ of \d+)"
-    ]
-    for pattern in footer_patterns:
-        match = re.search(pattern, text, flags=re.DOTALL | re.IGNORECASE)
+    )
+]
+
+_PAGINATION_RE = re.compile(r"\b\d+\s+of\s+\d+\b")
+_BLANK_LINES_RE = re.compile(r'\n{3,}')
+
+
+def clean_text(text: str) -> str:
+    """
+    Applies Regex cleaning rules to remove noise (headers, footers, pagination).
+    """
+    for pattern in _NOISE_RES:
+        text = pattern.sub("", text)
+
+    text = _HEADER_RE.sub("", text)
+
+    for pattern in _FOOTER_RES:
+        match = pattern.search(text)
         if match:
             text = text[:match.start()]
 
-    text = re.sub(r"\b\d+\s+of\s+\d+\b", "", text)
-    text = re.sub(r'\n{3,}', '\n\n', text)
+    text = _PAGINATION_RE.sub("", text)
+    text = _BLANK_LINES_RE.sub('\n\n', text)
     return text.strip()
 
 
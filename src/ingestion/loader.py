@@ -4,6 +4,7 @@ from typing import List
 
 from llama_index.core.schema import TextNode
 from .cleaner import clean_text
+from src.text_utils import fold_case
 # ---------------------------------------------------------
 # CHANGE 1: Import the new function
 # ---------------------------------------------------------
@@ -194,15 +195,24 @@ class PDFLoader:
         """Helper to create node and append to list to avoid code duplication."""
         text_for_storage = cleaned_original.lower()            
         page_label = f"Page {i + 1}"
-        annotated_original = f"Source: {file_name}, {page_label}.\n{cleaned_original}"
+        source_header = f"Source: {file_name}, {page_label}.\n"
+        annotated_original = source_header + cleaned_original
+        sop_title = sop_meta.get("document_title") or file_name.replace(".pdf", "").replace("_", " ")
         
         node = TextNode(
             text=text_for_storage,
             metadata={
                 "file_name": file_name,
                 "page_label": page_label,
-                "sop_title": sop_meta.get("document_title") or file_name.replace(".pdf", "").replace("_", " "),
+                "sop_title": sop_title,
                 "original_text": annotated_original,
+                # Packed (sop_title, file_name, page_label, version) read by the RAG result loops
+                "_src": (sop_title, file_name, page_label, sop_meta.get("version_number", "Unknown")),
+                # Case-folded, newline-free original_text (same offsets) for keyword search;
+                # snippets are sliced from original_text at the offsets found here
+                "_scan": fold_case(annotated_original).replace("\n", " ").replace("\r", " "),
+                # Length of the "Source: ..." header, so search can slice straight to the body
+                "_body_off": len(source_header),
                 "document_number": sop_meta.get("document_number", "Unknown"),
                 "version_number": sop_meta.get("version_number", "Unknown"),
                 "status": "Active",                
@@ -210,8 +220,8 @@ class PDFLoader:
             }
         )
                 
-        node.excluded_embed_metadata_keys = ["original_text"]
-        node.excluded_llm_metadata_keys = ["original_text"]
+        node.excluded_embed_metadata_keys = ["original_text", "_src", "_scan", "_body_off"]
+        node.excluded_llm_metadata_keys = ["original_text", "_src", "_scan", "_body_off"]
         page_nodes.append(node)
 
     # =========================================================================
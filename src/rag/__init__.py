@@ -1,10 +1,30 @@
 # src/rag/__init__.py
 
+import threading
+from functools import lru_cache
+
 from src.rag.generator import LLMGenerator
 from src.rag.retriever import FASAEngine
 
 # 1. Initialize Global LLM Settings immediately on import.
 LLMGenerator.configure_llm()
 
-# 2. Export the Main Engine class for the UI to use
-__all__ = ["FASAEngine"]
\ No newline at end of file
+
+# 2. Process-wide engine: every Streamlit session / API worker thread shares ONE instance
+#    (one Qdrant client pair, one index, one set of caches) instead of rebuilding it.
+_engine_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def _shared_engine() -> FASAEngine:
+    return FASAEngine()
+
+
+def get_engine() -> FASAEngine:
+    """Returns the shared FASAEngine, building it on first use (the lock stops a double build)."""
+    with _engine_lock:
+        return _shared_engine()
+
+
+# 3. Export the Main Engine class (and its shared instance) for the UI to use
+__all__ = ["FASAEngine", "get_engine"]
\ No newline at end of file
@@ -18,6 +18,10 @@ class LLMGenerator:
 
         base_url = RUNPOD_URL
         model_name = "llama3.1:8b"
+        # How long Ollama keeps the model (and the KV cache of the last prompt) loaded between
+        # requests. Ollama's default of 5 minutes means a cold reload + full prompt evaluation
+        # after every quiet spell; while loaded, the static prompt prefix is not re-evaluated.
+        keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
 
         try:
             print(f"Connecting to Ollama LLM at {base_url}...")
@@ -27,6 +31,7 @@ class LLMGenerator:
                 base_url=base_url,
                 temperature=0.3,
                 request_timeout=3000.0,
+                keep_alive=keep_alive,
                 context_window=4096, # Use this ---> 8192
                 additional_kwargs={
                 "num_ctx": 4096 # Use this ---> 8192
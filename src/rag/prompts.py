@@ -1,5 +1,9 @@
 from llama_index.core import PromptTemplate
 
+# Layout: [static instructions + rules][retrieved context][user question].
+# Everything above {context_str} is byte-identical for every query, so Ollama reuses the KV cache
+# of that prefix and only evaluates the context + question tokens. Keep per-query values
+# (dates, user names, query-dependent rules) out of the static part.
 STRICT_QA_PROMPT_STR = (
     "You are **FASA (Fast AI SOP Assistant)**, a specialized pharmaceutical regulatory assistant and expert in pharmaceutical SOPs, regulatory compliance, and quality standards.\n\n"
 
@@ -1,27 +1,291 @@
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Callable, List, Optional, AsyncIterator, Iterator
 import re
+import queue
+import asyncio
 import string
+import threading
+from functools import lru_cache
+from dataclasses import dataclass
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+
+try:
+    # pyahocorasick: one-pass keyword scan used by search() (falls back to regex when missing)
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
 
 # LlamaIndex Core
-from llama_index.core import VectorStoreIndex, get_response_synthesizer
-from llama_index.core.retrievers import VectorIndexRetriever
+from llama_index.core import Settings, get_response_synthesizer
+from llama_index.core.base.base_retriever import BaseRetriever
 from llama_index.core.query_engine import RetrieverQueryEngine
 from llama_index.core.postprocessor.types import BaseNodePostprocessor
 from llama_index.core.schema import NodeWithScore, QueryBundle
-from llama_index.core.postprocessor import SimilarityPostprocessor
 # It is now located in the 'types' submodule
 from llama_index.core.postprocessor.types import BaseNodePostprocessor
-from llama_index.core.vector_stores import MetadataFilters, MetadataFilter
+from llama_index.core.vector_stores.types import VectorStoreQuery, VectorStoreQueryMode, VectorStoreQueryResult
 
 # Internal Modules
 from src.indexing.vector_db import QdrantManager
 from src.indexing.embeddings import EmbeddingManager
 from src.rag.prompts import get_prompts
+from src.cache import AnswerCache, SemanticCache, EmbeddingCache, CorpusVocabulary, SEARCH_DB
+from src.text_utils import normalize_text, is_trivial_query, fold_case
+
+# --- SEARCH TERM FILTERING (search) ---
+# Built once at import; _extract_search_terms() only does membership tests against it.
+# Comprehensive list of English "Noise" words
+_BASE_STOP_WORDS = {
+    # To Be / Auxiliaries
+    "is", "am", "are", "was", "were", "be", "been", "being",
+    "have", "has", "had", "do", "does", "did", "doing",
+    "will", "would", "shall", "should", "can", "could", 
+    "may", "might", "must", "ought",
+
+    # Pronouns
+    "i", "me", "my", "myself", "we", "us", "our", "ours", "ourselves",
+    "you", "your", "yours", "yourself", "yourselves",
+    "he", "him", "his", "himself", "she", "her", "hers", "herself",
+    "it", "its", "itself", "they", "them", "their", "theirs", "themselves",
+
+    # Articles & Determiners
+    "a", "an", "the", "this", "that", "these", "those",
+
+    # Prepositions & Conjunctions
+    "and", "but", "if", "or", "because", "as", "until", "while",
+    "of", "at", "by", "for", "with", "about", "against", "between",
+    "into", "through", "during", "before", "after", "above", "below",
+    "to", "from", "up", "down", "in", "out", "on", "off", "over", "under",
+    "again", "further", "then", "once",
+
+    # Common Adverbs & Others
+    "here", "there", "when", "where", "why", "how",
+    "all", "any", "both", "each", "few", "more", "most", "other", "some", "such",
+    "no", "nor", "not", "only", "own", "same", "so", "than", "too", "very",
+    "just", "don", "now", "s", "t", "re", "ve", "m", "d", "ll"
+}
+
+_ADDITIONAL_STOP_WORDS = {
+    # --- 1. Expanded Prepositions & Location ---
+    # Common in formal writing but usually noise for search
+    "within", "without", "upon", "among", "amongst", "throughout", 
+    "despite", "towards", "toward", "beside", "besides", "beyond", 
+    "concerning", "regarding", "versus", "via", "per", "inside", 
+    "outside", "near", "far", "amid", "amidst", "around",
+
+    # --- 2. Logical Transitions & Connectors ---
+    # SOPs use these to structure sentences ("Therefore, the user must...")
+    "however", "therefore", "thus", "hence", "otherwise", "although", 
+    "though", "whereas", "whenever", "wherever", "whereby", "wherein", 
+    "whereupon", "unless", "except", "meanwhile", "furthermore", 
+    "moreover", "nevertheless", "nonetheless", "instead", "eventually",
+
+    # --- 3. Indefinite Pronouns & Quantifiers ---
+    # These dilute the search for specific items
+    "anyone", "anything", "anywhere", "anybody",
+    "everyone", "everything", "everywhere", "everybody",
+    "someone", "something", "somewhere", "somebody",
+    "nobody", "nothing", "nowhere", "none",
+    "either", "neither", "another", "plenty", "various", "amount",
+    "whole", "half", "certain", "entire", "various", "several",
+
+    # --- 4. Extremely Generic Verbs (All Tenses) ---
+    # These actions are too vague to be useful keywords
+    "use", "used", "using", "uses",       # "Using a beaker" -> Search "Beaker"
+    "make", "made", "making", "makes",    # "Make a solution" -> Search "Solution"
+    "keep", "kept", "keeping", "keeps", 
+    "let", "lets", "letting", 
+    "put", "putting", "puts",
+    "take", "took", "taken", "taking", "takes",
+    "get", "got", "getting", "gets", "gotten",
+    "go", "went", "gone", "going", "goes",
+    "come", "came", "coming", "comes",
+    "become", "became", "becoming", "becomes",
+    "seem", "seemed", "seeming", "seems",
+    "look", "looked", "looking", "looks",
+    "find", "found", "finding", "finds",
+    "try", "tried", "trying", "tries",
+    "need", "needed", "needing", "needs",
+    "want", "wanted", "wanting", "wants",
+    "say", "said", "saying", "says",
+    "know", "knew", "known", "knowing", "knows",
+    "think", "thought", "thinking", "thinks", "what",
+
+    # --- 5. Common SOP/Document "Filler" ---
+    # Words that appear in almost every document but aren't the *topic*
+    "etc", "ie", "eg", "viz", "ex", "example", 
+    "please", "kindly", "follow", "followed", "following", # "Following procedure" -> "Procedure"
+    "ensure", "ensuring", "ensured",  # Very common in SOPs ("Ensure safety")
+    "describe", "described", "describing", 
+    "refer", "referred", "referring", "reference",
+    "related", "relating", "relate",
+    "accordance", "according",  # "In accordance with"
+    "stated", "stating", "states",
+    "listed", "listing", "lists",
+    "include", "included", "including", "includes",
+    "contain", "contained", "containing", "contains",
+    "consist", "consisted", "consisting", "consists",
+    "base", "based", "basing", "bases",
+    "high", "low", "good", "bad", "big", "small", "main", "major", "minor",
+
+    # --- 6. Time Fillers ---
+    "always", "never", "often", "sometimes", "usually", "rarely",
+    "daily", "weekly", "monthly", "yearly", "annually",
+    "today", "yesterday", "tomorrow", "now", "then", "later", 
+    "early", "soon", "already", "recently", "currently"
+}
+
+_STOP_WORDS: frozenset = frozenset(_BASE_STOP_WORDS | _ADDITIONAL_STOP_WORDS)
+
+# Punctuation -> space table; includes: !"#$%&'()*+,-./:;<=>?@[\]^_`{|}~
+_PUNCT_TRANS = str.maketrans({c: " " for c in string.punctuation})
+
+
+# --- KEYWORD MATCHING HELPERS (search) ---
+# Newline -> space table for snippet text (one C-level pass per chunk)
+_NL_TABLE = str.maketrans({"\n": " ", "\r": " "})
+
+# Word tokens for the set-membership prefilter (regex fallback only)
+_WORD_RE = re.compile(r"\w+")
+
+SNIPPET_WINDOW = 60  # characters of context on each side of a hit
+MAX_SNIPPETS = 3     # snippets kept per SOP
+
+# --- HYBRID RETRIEVAL (query engines + query_batch) ---
+HYBRID_TOP_K = 7
+HYBRID_ALPHA = 0.7
+
+@lru_cache(maxsize=256)
+def _compile_highlight(terms: tuple) -> "re.Pattern":
+    """Whole-word alternation over the (escaped) terms; memoized per term-set."""
+    safe_terms = [re.escape(t) for t in terms]
+    return re.compile(rf"\b({'|'.join(safe_terms)})\b")
+
+@lru_cache(maxsize=256)
+def _build_term_automaton(terms: tuple):
+    """Builds one Aho-Corasick automaton over all (lowercase) search terms; memoized per term-set."""
+    automaton = ahocorasick.Automaton()
+    for term in terms:
+        automaton.add_word(term, len(term))
+    automaton.make_automaton()
+    return automaton
+
+
+def _snippet_windows(first_hit, lowered: str, limit: int, pos: int = 0, window: int = SNIPPET_WINDOW):
+    """
+    Up to `limit` (start, end) snippet windows around term hits at or after `pos` (clamped to it).
+    Each lookup resumes where the previous window ended, so one passage is never shown twice.
+    """
+    floor = pos
+    windows = []
+    while len(windows) < limit:
+        span = first_hit(lowered, pos)
+        if span is None:
+            break
+        start, end = span
+        windows.append((max(floor, start - window), end + window))
+        pos = end + window
+    return windows
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+def _automaton_spans(automaton, lowered: str, pos: int = 0):
+    """
+    Yields (start, end) of whole-word term hits in already-lowercased text from `pos` on,
+    in order of position. Mirrors the regex \\b...\\b semantics by checking the neighbouring characters.
+    """
+    last = len(lowered) - 1
+    for end_idx, term_len in automaton.iter(lowered, pos):
+        start_idx = end_idx - term_len + 1
+        if start_idx > 0 and _is_word_char(lowered[start_idx - 1]):
+            continue
+        if end_idx < last and _is_word_char(lowered[end_idx + 1]):
+            continue
+        yield start_idx, end_idx + 1
+
+
+@lru_cache(maxsize=256)
+def _build_matchers(term_key: tuple) -> tuple:
+    """
+    Returns (first_hit, has_hit) for a term-set, memoized so repeat searches reuse them.
+    first_hit(lowered, pos) -> (start, end) of the first hit at/after pos, or None.
+    """
+    # Matcher used for both filtering and highlighting. Both variants run on text that is
+    # already lowercased (see '_scan') and only accept whole-word hits.
+    # - Aho-Corasick (preferred): one O(text + hits) pass regardless of the number of terms.
+    # - Fallback regex: \b(word1|word2|word3)\b (OR Logic), terms escaped for '+', '?' etc.
+    if ahocorasick is not None:
+        automaton = _build_term_automaton(term_key)
+        first_hit = lambda lowered, pos=0: next(_automaton_spans(automaton, lowered, pos), None)
+    else:
+        highlight_pattern = _compile_highlight(term_key)
+        def first_hit(lowered, pos=0):
+            m = highlight_pattern.search(lowered, pos)
+            return m.span() if m else None
+
+    # "Does this chunk contain ANY term?" filter
+    has_hit = lambda lowered: first_hit(lowered) is not None
+    if ahocorasick is None and all(_WORD_RE.fullmatch(t) for t in term_key):
+        # Regex fallback: tokenize once and do hashed set lookups instead of running the
+        # alternation over every candidate; the regex is only used for the snippets.
+        # Same whole-word semantics as \b...\b as long as every term is a plain \w+ token.
+        term_set = frozenset(term_key)
+        has_hit = lambda lowered: not term_set.isdisjoint(_WORD_RE.findall(lowered))
+
+    return first_hit, has_hit
+
+
+# --- SHARED ENGINE COMPONENTS ---
+# Built once per process and shared by every engine (sync + streaming, all FASAEngine instances).
+@lru_cache(maxsize=1)
+def _prompts():
+    return get_prompts()
+
+
+@dataclass(slots=True, frozen=True)
+class _SearchCtx:
+    """Everything search() needs that does not depend on the query; built once per engine."""
+    stop_words: frozenset
+    punct_table: dict
+    vector_store: Any       # QdrantVectorStore, queried directly in sparse (BM25) mode
+    keyword_filter: Callable  # terms -> Qdrant Filter (Active + contains any term)
+    matchers: Callable      # term_key -> (first_hit, has_hit), memoized
+    top_k: int = 100
+
+
+def _to_candidates(result: VectorStoreQueryResult) -> List[NodeWithScore]:
+    """Vector store result -> scored nodes (hybrid retriever, query_batch and search)."""
+    return [
+        NodeWithScore(node=node, score=score)
+        for node, score in zip(result.nodes or [], result.similarities or [])
+    ]
+
+
+def _source_meta(meta: Dict[str, Any]) -> tuple:
+    """(sop_title, file_name, page_label, version) of a node; older nodes without '_src' use per-key gets."""
+    src = meta.get("_src")
+    if src:
+        return src
+    return (
+        meta.get("sop_title", "Unknown SOP"),
+        meta.get("file_name", "N/A"),
+        meta.get("page_label", "N/A"),
+        # Same default the loader packs into '_src' and 'version_number'
+        meta.get("version_number", "Unknown")
+    )
+
 
 # --- HELPER CLASS FOR TEXT SWAPPING ---
 class MetadataTextRestorer(BaseNodePostprocessor):
     """
     A custom Postprocessor that runs immediately after retrieval.
+    Collections indexed before QdrantManager.insert_nodes stored 'original_text' as the node
+    text still hold the lowercased, header-stripped text; this puts the original back before
+    it reaches the LLM and the citations. On newer collections it is one dict lookup per node.
     """
     def _postprocess_nodes(
         self, nodes: List[NodeWithScore], query_bundle: Optional[QueryBundle] = None
@@ -29,10 +293,46 @@ class MetadataTextRestorer(BaseNodePostprocessor):
         
         for node_w_score in nodes:
             node = node_w_score.node
-            if "original_text" in node.metadata:
-                node.text = node.metadata["original_text"]
+            # One dict lookup; skip the (validated) attribute write when already restored
+            original_text = node.metadata.get("original_text")
+            if original_text is not None and node.text != original_text:
+                node.text = original_text
         return nodes
 
+# --- HYBRID RETRIEVER ---
+class QdrantHybridRetriever(BaseRetriever):
+    """
+    Dense + BM25 retrieval of Active chunks through QdrantManager's hybrid search: both legs in
+    ONE query_batch_points call, fused like the store's own hybrid mode.
+    QDRANT_SCORE_THRESHOLD (optional) is a cosine cutoff on the DENSE leg only, applied by Qdrant:
+    BM25 hits are never thresholded and the fused scores are not filtered, so a chunk below the
+    cutoff can still be returned through its keyword match.
+    """
+
+    def __init__(self, db_manager: QdrantManager, top_k: int = HYBRID_TOP_K, alpha: float = HYBRID_ALPHA):
+        super().__init__()
+        self._db = db_manager
+        self._top_k = top_k
+        self._alpha = alpha
+        self._filter = db_manager.active_filter()
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        embedding = query_bundle.embedding or Settings.embed_model.get_query_embedding(query_bundle.query_str)
+        result = self._db.hybrid_query_batch(
+            [query_bundle.query_str], [embedding], self._top_k, self._alpha, self._filter
+        )[0]
+        return _to_candidates(result)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        embedding = query_bundle.embedding or await Settings.embed_model.aget_query_embedding(
+            query_bundle.query_str
+        )
+        result = (await self._db.ahybrid_query_batch(
+            [query_bundle.query_str], [embedding], self._top_k, self._alpha, self._filter
+        ))[0]
+        return _to_candidates(result)
+
+
 # --- MAIN ENGINE CLASS ---
 class FASAEngine:
     """
@@ -48,33 +348,154 @@ class FASAEngine:
         # 2. Connect to Database
         self.db_manager = QdrantManager()
         
-        # 3. Load Index from Vector Store
-        try:
-            self.index = VectorStoreIndex.from_vector_store(
-                vector_store=self.db_manager.vector_store
-            )
-        except Exception as e:
-            print(f"Failed to load Vector Index: {e}")
-            raise e
+        # 3. Search Context: Broad Keyword Search (Sparse/BM25) + query-independent setup.
+        # Built once here so each search() call only does the work that depends on its input.
+        # The "contains any term" predicate runs in Qdrant (full-text index), so only chunks
+        # that really hold a keyword come back for snippet extraction.
+        self._ctx = _SearchCtx(
+            stop_words=_STOP_WORDS,
+            punct_table=_PUNCT_TRANS,
+            vector_store=self.db_manager.vector_store,
+            keyword_filter=self.db_manager.keyword_filter,
+            matchers=_build_matchers
+        )
             
         # 4. Build the Query Engine (The "Brain")
         self.query_engine = self._build_engine()
+        # Same pipeline with a token-streaming synthesizer (used by query_stream)
+        self._stream_engine = self._build_engine(streaming=True)
+
+        # 5. Answer caches
+        #    - semantic_cache: in-memory exact + near-duplicate hits (cosine >= 0.97 at first, then
+        #                      learned per region between 0.90 and 1.0, see _same_answer)
+        #    - answer_cache:   persistent exact-match store (survives restarts, 1h TTL)
+        self.semantic_cache = SemanticCache(max_size=512, ttl=3600.0, threshold=0.97, min_threshold=0.90)
+        self.answer_cache = AnswerCache()
+        #    - search_cache:   persistent keyword search() results, keyed by the sorted term-set
+        self.search_cache = AnswerCache(SEARCH_DB, ttl=900.0)
+        #    - embedding_cache: query vectors (memory LRU + dbm), skips the Ollama embed call on repeats
+        self.embedding_cache = EmbeddingCache(max_size=4096)
+        #    Every answer key carries the index version, so upserts/deletes retire old entries
+        self._index_version = self.db_manager.index_version.get()
+
+        self._warm_semantic_cache()
+
+        # 6. Concurrency
+        #    - _loop: one long-lived event loop (daemon thread) that query()/query_async() run
+        #      aquery() on; the async Qdrant/Ollama clients stay bound to a single loop
+        #    - _pool: worker threads for the CPU-side helpers (BM25 query encoding)
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name="fasa-loop", daemon=True).start()
+        self._pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="fasa-query")
+
+        # 7. Corpus Vocabulary: lets search() skip Qdrant for terms that occur in no SOP.
+        # In memory, scanned from this engine's collection in the background; rescanned whenever
+        # the index version moves (until then search() simply asks Qdrant).
+        self.corpus_vocab = CorpusVocabulary()
+        self._vocab_lock = threading.Lock()
+        self._vocab_scanning = False
+        self._refresh_corpus_vocab(self._index_version)
+
+    def _refresh_corpus_vocab(self, version: int):
+        """Starts a background vocabulary scan for `version` (one at a time)."""
+        with self._vocab_lock:
+            if self._vocab_scanning:
+                return
+            self._vocab_scanning = True
+
+        def _scan():
+            try:
+                self.corpus_vocab.build(self.db_manager.iter_chunk_texts(), version)
+            except Exception as e:
+                print(f"Corpus vocabulary unavailable, search() will query Qdrant for every term: {e}")
+            finally:
+                with self._vocab_lock:
+                    self._vocab_scanning = False
+
+        self._pool.submit(_scan)
+
+    def _known_miss(self, filtered_terms: List[str]) -> bool:
+        """
+        True only when the vocabulary of the CURRENT index version proves that none of the terms
+        occurs in any SOP. An outdated vocabulary never short-circuits; it is rescanned instead.
+        """
+        version = self.db_manager.index_version.get()
+        if self.corpus_vocab.version != version:
+            self._refresh_corpus_vocab(version)
+            return False
+        return not self.corpus_vocab.contains_any(filtered_terms, version)
+
+    def _warm_semantic_cache(self):
+        """
+        Refills the in-memory semantic cache from the persistent stores after a restart:
+        recent answers from SQLite + their query vectors from the embedding cache (no Ollama calls).
+        """
+        try:
+            model_name = Settings.embed_model.model_name
+            prefix = self._answer_key("")
+            warmed = 0
+            # Oldest first, so the newest answers end up at the LRU's "recent" end
+            for key, payload, ts in reversed(self.answer_cache.recent(self.semantic_cache.max_size)):
+                if not key.startswith(prefix):
+                    continue  # answered against an older index version
+                embedding = self.embedding_cache.get(key[len(prefix):], model_name)
+                if embedding is not None:
+                    self.semantic_cache.put(key, embedding, payload, ts=ts)
+                    warmed += 1
+            print(f">>> Semantic cache warmed with {warmed} answers.")
+        except Exception as e:
+            print(f"Semantic cache warm start skipped: {e}")
+
+    def _answer_key(self, normalized_query: str) -> str:
+        """
+        Answer cache key: "v<index_version>|<normalized query>".
+        When the index changed since the last lookup the in-memory tier is dropped as well
+        (its near-duplicate tier matches on embeddings, not on keys).
+        """
+        version = self.db_manager.index_version.get()
+        if version != self._index_version:
+            self.semantic_cache.clear()
+            self._index_version = version
+        return f"v{version}|{normalized_query}"
+
+    @staticmethod
+    def _same_answer(cached: Dict[str, Any], fresh: Dict[str, Any]) -> bool:
+        """
+        Semantic cache feedback: a cached answer counts as equivalent to a fresh one only when
+        both cite the same passages (file + page) AND say the same thing (case/whitespace aside).
+        Citing the same SOP is not enough: different questions about one SOP do that too.
+        """
+        def cited(result: Dict[str, Any]) -> set:
+            return {(src["file_name"], src["page"]) for src in result["sources"]}
+
+        return (
+            cited(cached) == cited(fresh)
+            and " ".join(cached["answer"].lower().split()) == " ".join(fresh["answer"].lower().split())
+        )
 
-    def _build_engine(self) -> RetrieverQueryEngine:
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """
+        Hit/miss/eviction counters of the answer caches (for the admin dashboard / logs).
+        Every answered question lands in exactly one bucket: a semantic hit (either tier), a disk
+        hit, or a semantic miss (sent to the RAG pipeline); "hit_rate" is computed over those.
+        """
+        semantic = self.semantic_cache.stats()
+        answers = self.answer_cache.stats()
+        served = semantic["hits"] + answers["hits"]
+        total = served + semantic["misses"]
+        return {
+            "index_version": self._index_version,
+            "hit_rate": served / total if total else 0.0,
+            "semantic": semantic,
+            "answers": answers,
+            "search": self.search_cache.stats(),
+        }
 
-        # --- NEW: Define Filter for "Active" status ---
-        # This acts like a strict gatekeeper.
-        active_filter = MetadataFilters(
-            filters=[MetadataFilter(key="status", value="Active")]
-        )
+    def _build_engine(self, streaming: bool = False) -> RetrieverQueryEngine:
 
-        # A. Retriever (Now includes the filter)
-        retriever = self.index.as_retriever(
-            similarity_top_k=7, 
-            vector_store_query_mode="hybrid", 
-            alpha=0.7,
-            filters=active_filter  # <--- CRITICAL UPDATE HERE
-        )
+        # A. Retriever: hybrid over Active chunks only; quantized ANN + rescoring and the
+        #    optional dense score cutoff are applied by Qdrant (see QdrantManager)
+        retriever = QdrantHybridRetriever(self.db_manager, top_k=HYBRID_TOP_K, alpha=HYBRID_ALPHA)
 
         # # A. Retriever
         # retriever = self.index.as_retriever(
@@ -83,58 +504,83 @@ class FASAEngine:
         #     alpha=0.7
         # )
 
-        # --- NEW: SCORE FILTER ---
-        # This drops any chunk with a score below 0.05
-        cutoff_processor = SimilarityPostprocessor(cutoff=0.05)
-
-        # B. Postprocessor (The "Fixer")
-        text_restorer = MetadataTextRestorer()
-
-        # C. Response Synthesizer (The "Writer")
+        # B. Response Synthesizer (The "Writer")
         synth = get_response_synthesizer(
-            text_qa_template=get_prompts(),
-            response_mode="compact"
+            text_qa_template=_prompts(),
+            response_mode="compact",
+            streaming=streaming
         )
         
-        # D. Assemble
+        # C. Assemble (no Python-side score filter: the cutoff runs in Qdrant)
         return RetrieverQueryEngine(
             retriever=retriever,
             response_synthesizer=synth,
-            node_postprocessors=[cutoff_processor, text_restorer]
+            node_postprocessors=[MetadataTextRestorer()]
         )
 
     def query(self, query_text: str) -> Dict[str, Any]:
-        if not query_text.strip():
+        """
+        Sync entry point (Streamlit, scripts): runs aquery() on the engine's event loop and waits.
+        Concurrent callers share that loop, so their Qdrant/Ollama waits overlap instead of
+        each request holding a thread for the whole pipeline.
+        """
+        return self.query_async(query_text).result()
+
+    async def _aquery(self, query_text: str) -> Dict[str, Any]:
+        """
+        The query path (runs on the engine loop; see aquery() for event-loop callers).
+        Embedding, Qdrant retrieval (AsyncQdrantClient) and Ollama generation are all awaited,
+        so concurrent requests overlap instead of queuing behind each other.
+        For token streaming use query_stream().
+        """
+        normalized_query = normalize_text(query_text)
+        if is_trivial_query(normalized_query):
             return {"answer": "Please enter a valid query.", "sources": []}
-            
+
         print(f">>>>>>>>>>>>>>>>>>>>>>>>>>>>>>   Querying: '{query_text}'")
-        
+
         try:
-            normalized_query = query_text.lower()
+            answer_key = self._answer_key(normalized_query)
+
+            # CACHE LOOKUP
+            # A. Exact match (memory, then disk)
+            cached = self.semantic_cache.get_exact(answer_key)
+            if cached is None:
+                cached = self.answer_cache.get(answer_key)
+            if cached is not None:
+                print(">>>>>>>>>>>>>>>>>>>>>>     Answer served from cache.")
+                return cached
+
+            # B. Near-duplicate question (one embedding, one matrix-vector product)
+            # Dense embedding (awaited) and BM25 query encoding (worker thread) run concurrently
+            query_embedding, _ = await asyncio.gather(
+                self.embedding_cache.aget_query_embedding(Settings.embed_model, normalized_query),
+                asyncio.get_running_loop().run_in_executor(
+                    self._pool, self.db_manager.encode_sparse_query, normalized_query
+                ),
+            )
+            cached = self.semantic_cache.get_similar(query_embedding)
+            if cached is not None:
+                print(">>>>>>>>>>>>>>>>>>>>>>     Answer served from semantic cache.")
+                return cached
+
+            # EXECUTE RAG (reuse the embedding so the retriever does not embed the query again)
+            response = await self.query_engine.aquery(
+                QueryBundle(query_str=normalized_query, embedding=query_embedding)
+            )
 
-            # EXECUTE RAG
-            response = self.query_engine.query(normalized_query)
-            
             # PARSE SOURCES
-            sources = []
-            for node_w_score in response.source_nodes:
-                meta = node_w_score.node.metadata
-                
-                # Extract metadata
-                source_info = {
-                    "sop_title": meta.get("sop_title", "Unknown SOP"),
-                    "file_name": meta.get("file_name", "N/A"),
-                    "page": meta.get("page_label", "N/A"),
-                    "score": round(node_w_score.score, 3)
-                }
-                sources.append(source_info)
+            sources = self._parse_sources(response.source_nodes)
 
             print(f">>>>>>>>>>>>>>>>>>>>>>     Generated Answer using {len(sources)} valid chunks.")
-            
-            return {
+
+            result = {
                 "answer": str(response),
                 "sources": sources
             }
+            self.semantic_cache.put(answer_key, query_embedding, result, agrees=self._same_answer)
+            self.answer_cache.set(answer_key, result)
+            return result
 
         except Exception as e:
             print(f"Query Failed: {e}")
@@ -147,131 +593,414 @@ class FASAEngine:
             }
         
     
-    def search(self, query_term: str) -> List[Dict[str, Any]]:
-        if not query_term.strip():
+    @staticmethod
+    def _parse_sources(source_nodes: List[NodeWithScore]) -> List[Dict[str, Any]]:
+        # Scores rounded in one NumPy pass (float64, so .tolist() gives clean 3-decimal floats)
+        scores = np.round(
+            np.fromiter((n.score or 0.0 for n in source_nodes), dtype=np.float64, count=len(source_nodes)), 3
+        ).tolist()
+
+        # One metadata read per node (packed '_src' at ingest), built in a single comprehension
+        return [
+            {
+                "sop_title": sop_title, "version": version,
+                "file_name": file_name, "page": page_label, "score": score
+            }
+            for n, score in zip(source_nodes, scores)
+            for sop_title, file_name, page_label, version in (_source_meta(n.node.metadata),)
+        ]
+
+    async def _query_stream(self, query_text: str) -> AsyncIterator[Dict[str, Any]]:
+        """Body of query_stream() (runs on the engine loop)."""
+        normalized_query = normalize_text(query_text)
+        if is_trivial_query(normalized_query):
+            yield {"event": "sources", "data": []}
+            yield {"event": "token", "data": "Please enter a valid query."}
+            return
+
+        print(f">>>>>>>>>>>>>>>>>>>>>>>>>>>>>>   Streaming Query: '{query_text}'")
+        answer_key = self._answer_key(normalized_query)
+
+        try:
+            # Same cache tiers as query(): exact (memory, then disk), then near-duplicate
+            cached = self.semantic_cache.get_exact(answer_key)
+            if cached is None:
+                cached = self.answer_cache.get(answer_key)
+            if cached is None:
+                query_embedding = await self.embedding_cache.aget_query_embedding(
+                    Settings.embed_model, normalized_query
+                )
+                cached = self.semantic_cache.get_similar(query_embedding)
+            if cached is not None:
+                yield {"event": "sources", "data": cached["sources"]}
+                yield {"event": "token", "data": cached["answer"]}
+                return
+
+            # Retrieval + postprocessing finish here; synthesis is returned as a token stream
+            response = await self._stream_engine.aquery(
+                QueryBundle(query_str=normalized_query, embedding=query_embedding)
+            )
+            sources = self._parse_sources(response.source_nodes)
+            yield {"event": "sources", "data": sources}
+
+            answer_parts = []
+            async for token in response.async_response_gen():
+                answer_parts.append(token)
+                yield {"event": "token", "data": token}
+
+            result = {"answer": "".join(answer_parts), "sources": sources}
+            self.semantic_cache.put(answer_key, query_embedding, result, agrees=self._same_answer)
+            self.answer_cache.set(answer_key, result)
+
+        except Exception as e:
+            print(f"Streaming Query Failed: {e}")
+            yield {
+                "event": "token",
+                "data": "System Error: Unable to process query. Please ensure Ollama is running."
+            }
+
+    def query_async(self, query_text: str) -> Future:
+        """
+        Schedules aquery() on the engine's event loop and returns a concurrent Future.
+        Handlers can fire several questions and collect them with .result().
+        """
+        return asyncio.run_coroutine_threadsafe(self._aquery(query_text), self._loop)
+
+    def retrieve(self, query_text: str) -> List[Dict[str, Any]]:
+        """
+        Retrieval-only variant of query() for "show me the SOP passages" views: same hybrid
+        retrieval + postprocessing, no LLM synthesis. Returns the sources with their passage text.
+        """
+        return asyncio.run_coroutine_threadsafe(self._aretrieve(query_text), self._loop).result()
+
+    async def _aretrieve(self, query_text: str) -> List[Dict[str, Any]]:
+        normalized_query = normalize_text(query_text)
+        if is_trivial_query(normalized_query):
             return []
 
-        print(f">>> Performing Broad Multi-Keyword Search for: '{query_term}'")
+        print(f">>>>>>>>>>>>>>>>>>>>>>>>>>>>>>   Retrieving: '{query_text}'")
+        try:
+            query_embedding, _ = await asyncio.gather(
+                self.embedding_cache.aget_query_embedding(Settings.embed_model, normalized_query),
+                asyncio.get_running_loop().run_in_executor(
+                    self._pool, self.db_manager.encode_sparse_query, normalized_query
+                ),
+            )
+            nodes = await self.query_engine.aretrieve(
+                QueryBundle(query_str=normalized_query, embedding=query_embedding)
+            )
+            sources = self._parse_sources(nodes)
+            for source, n in zip(sources, nodes):
+                source["text"] = n.node.metadata.get("original_text", n.node.text)
+            return sources
 
-        # Standard Punctuation from Python's library
-        # Includes: !"#$%&'()*+,-./:;<=>?@[\]^_`{|}~
-        PUNCTUATION_SET = set(string.punctuation)
-
-        # Comprehensive list of English "Noise" words
-        stop_words = {
-            # To Be / Auxiliaries
-            "is", "am", "are", "was", "were", "be", "been", "being",
-            "have", "has", "had", "do", "does", "did", "doing",
-            "will", "would", "shall", "should", "can", "could", 
-            "may", "might", "must", "ought",
-            
-            # Pronouns
-            "i", "me", "my", "myself", "we", "us", "our", "ours", "ourselves",
-            "you", "your", "yours", "yourself", "yourselves",
-            "he", "him", "his", "himself", "she", "her", "hers", "herself",
-            "it", "its", "itself", "they", "them", "their", "theirs", "themselves",
-            
-            # Articles & Determiners
-            "a", "an", "the", "this", "that", "these", "those",
-            
-            # Prepositions & Conjunctions
-            "and", "but", "if", "or", "because", "as", "until", "while",
-            "of", "at", "by", "for", "with", "about", "against", "between",
-            "into", "through", "during", "before", "after", "above", "below",
-            "to", "from", "up", "down", "in", "out", "on", "off", "over", "under",
-            "again", "further", "then", "once",
-            
-            # Common Adverbs & Others
-            "here", "there", "when", "where", "why", "how",
-            "all", "any", "both", "each", "few", "more", "most", "other", "some", "such",
-            "no", "nor", "not", "only", "own", "same", "so", "than", "too", "very",
-            "just", "don", "now", "s", "t", "re", "ve", "m", "d", "ll"
-        }
+        except Exception as e:
+            print(f"Retrieval Failed: {e}")
+            return []
 
-        ADDITIONAL_STOP_WORDS = {
-        # --- 1. Expanded Prepositions & Location ---
-        # Common in formal writing but usually noise for search
-        "within", "without", "upon", "among", "amongst", "throughout", 
-        "despite", "towards", "toward", "beside", "besides", "beyond", 
-        "concerning", "regarding", "versus", "via", "per", "inside", 
-        "outside", "near", "far", "amid", "amidst", "around",
-
-        # --- 2. Logical Transitions & Connectors ---
-        # SOPs use these to structure sentences ("Therefore, the user must...")
-        "however", "therefore", "thus", "hence", "otherwise", "although", 
-        "though", "whereas", "whenever", "wherever", "whereby", "wherein", 
-        "whereupon", "unless", "except", "meanwhile", "furthermore", 
-        "moreover", "nevertheless", "nonetheless", "instead", "eventually",
-
-        # --- 3. Indefinite Pronouns & Quantifiers ---
-        # These dilute the search for specific items
-        "anyone", "anything", "anywhere", "anybody",
-        "everyone", "everything", "everywhere", "everybody",
-        "someone", "something", "somewhere", "somebody",
-        "nobody", "nothing", "nowhere", "none",
-        "either", "neither", "another", "plenty", "various", "amount",
-        "whole", "half", "certain", "entire", "various", "several",
-
-        # --- 4. Extremely Generic Verbs (All Tenses) ---
-        # These actions are too vague to be useful keywords
-        "use", "used", "using", "uses",       # "Using a beaker" -> Search "Beaker"
-        "make", "made", "making", "makes",    # "Make a solution" -> Search "Solution"
-        "keep", "kept", "keeping", "keeps", 
-        "let", "lets", "letting", 
-        "put", "putting", "puts",
-        "take", "took", "taken", "taking", "takes",
-        "get", "got", "getting", "gets", "gotten",
-        "go", "went", "gone", "going", "goes",
-        "come", "came", "coming", "comes",
-        "become", "became", "becoming", "becomes",
-        "seem", "seemed", "seeming", "seems",
-        "look", "looked", "looking", "looks",
-        "find", "found", "finding", "finds",
-        "try", "tried", "trying", "tries",
-        "need", "needed", "needing", "needs",
-        "want", "wanted", "wanting", "wants",
-        "say", "said", "saying", "says",
-        "know", "knew", "known", "knowing", "knows",
-        "think", "thought", "thinking", "thinks", "what",
-
-        # --- 5. Common SOP/Document "Filler" ---
-        # Words that appear in almost every document but aren't the *topic*
-        "etc", "ie", "eg", "viz", "ex", "example", 
-        "please", "kindly", "follow", "followed", "following", # "Following procedure" -> "Procedure"
-        "ensure", "ensuring", "ensured",  # Very common in SOPs ("Ensure safety")
-        "describe", "described", "describing", 
-        "refer", "referred", "referring", "reference",
-        "related", "relating", "relate",
-        "accordance", "according",  # "In accordance with"
-        "stated", "stating", "states",
-        "listed", "listing", "lists",
-        "include", "included", "including", "includes",
-        "contain", "contained", "containing", "contains",
-        "consist", "consisted", "consisting", "consists",
-        "base", "based", "basing", "bases",
-        "high", "low", "good", "bad", "big", "small", "main", "major", "minor",
-        
-        # --- 6. Time Fillers ---
-        "always", "never", "often", "sometimes", "usually", "rarely",
-        "daily", "weekly", "monthly", "yearly", "annually",
-        "today", "yesterday", "tomorrow", "now", "then", "later", 
-        "early", "soon", "already", "recently", "currently"
+    # --- ASYNC ENTRY POINTS ---
+    # The shared Qdrant/Ollama async clients hold connections bound to the loop they were first
+    # used on, so every async path runs on the engine loop; callers on another loop (FastAPI,
+    # asyncio.run in a script) await it from there.
+    async def _on_engine_loop(self, coro):
+        if asyncio.get_running_loop() is self._loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self._loop))
+
+    async def aquery(self, query_text: str) -> Dict[str, Any]:
+        """Async variant of query() for event-loop callers (e.g. FastAPI)."""
+        return await self._on_engine_loop(self._aquery(query_text))
+
+    async def aretrieve(self, query_text: str) -> List[Dict[str, Any]]:
+        """Async variant of retrieve() (no LLM call)."""
+        return await self._on_engine_loop(self._aretrieve(query_text))
+
+    async def query_stream(self, query_text: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming variant of query() for UIs/SSE endpoints.
+        Yields {"event": "sources", "data": [...]} as soon as retrieval is done,
+        then {"event": "token", "data": "<text>"} chunks as the LLM writes the answer.
+        """
+        caller_loop = asyncio.get_running_loop()
+        if caller_loop is self._loop:
+            async for event in self._query_stream(query_text):
+                yield event
+            return
+
+        # Generator runs on the engine loop; events are handed over to the caller's loop
+        events: asyncio.Queue = asyncio.Queue()
+
+        async def _pump():
+            try:
+                async for event in self._query_stream(query_text):
+                    caller_loop.call_soon_threadsafe(events.put_nowait, event)
+            finally:
+                caller_loop.call_soon_threadsafe(events.put_nowait, None)
+
+        pump = asyncio.run_coroutine_threadsafe(_pump(), self._loop)
+        try:
+            while (event := await events.get()) is not None:
+                yield event
+        finally:
+            # Consumer stopped early (client disconnected / UI cancelled): stop the LLM stream too
+            pump.cancel()
+
+    async def astream_query(self, query_text: str) -> AsyncIterator[str]:
+        """Answer text only, chunk by chunk (query_stream() without the sources event)."""
+        async for event in self.query_stream(query_text):
+            if event["event"] == "token":
+                yield event["data"]
+
+    def stream_query(self, query_text: str) -> Iterator[Dict[str, Any]]:
+        """
+        Sync variant of query_stream() for threaded callers (Streamlit): same events, handed
+        over from the engine loop through a thread-safe queue as they are produced.
+        """
+        events: queue.Queue = queue.Queue()
+
+        async def _pump():
+            try:
+                async for event in self._query_stream(query_text):
+                    events.put(event)
+            finally:
+                events.put(None)
+
+        pump = asyncio.run_coroutine_threadsafe(_pump(), self._loop)
+        try:
+            while (event := events.get()) is not None:
+                yield event
+        finally:
+            pump.cancel()
+
+    async def query_batch(self, queries: List[str], max_concurrency: int = 8) -> List[Dict[str, Any]]:
+        """See _query_batch(): bulk answering with one embedding call and one Qdrant batch search."""
+        return await self._on_engine_loop(self._query_batch(queries, max_concurrency))
+
+    # Alias for bulk/evaluation callers (same coroutine)
+    abatch_query = query_batch
+
+    async def asearch(self, query_term: str, target_sops: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Async variant of search() for event-loop callers (e.g. FastAPI).
+        The Qdrant sparse round-trip runs on the AsyncQdrantClient, so it does not block the loop.
+        """
+        return await self._on_engine_loop(self._asearch(query_term, target_sops))
+
+    async def _query_batch(self, queries: List[str], max_concurrency: int = 8) -> List[Dict[str, Any]]:
+        """
+        Answers several questions at once (dashboards, bulk checks); results keep the input order.
+        Cache hits are served directly, the misses share ONE embedding round-trip and ONE Qdrant
+        batch search, then their Ollama syntheses run concurrently.
+        At most `max_concurrency` syntheses are in flight, so a large batch cannot swamp Ollama.
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(queries)
+
+        # 1. Serve trivial input / exact cache hits, group the rest by normalized query (dedup)
+        pending: Dict[str, List[int]] = {}
+        for pos, query_text in enumerate(queries):
+            normalized_query = normalize_text(query_text)
+            if is_trivial_query(normalized_query):
+                results[pos] = {"answer": "Please enter a valid query.", "sources": []}
+                continue
+            answer_key = self._answer_key(normalized_query)
+            cached = self.semantic_cache.get_exact(answer_key)
+            if cached is None:
+                cached = self.answer_cache.get(answer_key)
+            if cached is not None:
+                results[pos] = cached
+            else:
+                pending.setdefault(normalized_query, []).append(pos)
+
+        if not pending:
+            return results
+
+        print(f">>>>>>>>>>>>>>>>>>>>>>>>>>>>>>   Batch Querying: {len(pending)} question(s)")
+        error = {
+            "answer": "System Error: Unable to process query. Please ensure Ollama is running.",
+            "sources": []
         }
-        stop_words.update(ADDITIONAL_STOP_WORDS)
+
+        # 2. One batched embedding call for every query not in the embedding cache
+        # (EmbeddingManager sets no query_instruction, so text and query embeddings coincide)
+        batch_queries = list(pending)
+        model_name = Settings.embed_model.model_name
+        embeddings = [self.embedding_cache.get(q, model_name) for q in batch_queries]
+        to_embed = [i for i, emb in enumerate(embeddings) if emb is None]
+        try:
+            if to_embed:
+                fresh = await Settings.embed_model.aget_text_embedding_batch(
+                    [batch_queries[i] for i in to_embed]
+                )
+                for i, emb in zip(to_embed, fresh):
+                    embeddings[i] = emb
+                    self.embedding_cache.set(batch_queries[i], model_name, emb)
+        except Exception as e:
+            print(f"Batch Embedding Failed: {e}")
+            for positions in pending.values():
+                for pos in positions:
+                    results[pos] = error
+            return results
+
+        # 3. Hybrid retrieval for every question without a near-duplicate answer: one
+        #    query_batch_points call (dense + sparse request per question) instead of N.
+        #    One semantic lookup per question; its hits are served as-is in step 4
+        similar = [self.semantic_cache.get_similar(emb) for emb in embeddings]
+        to_retrieve = [i for i, cached in enumerate(similar) if cached is None]
+        retrieved: Dict[int, VectorStoreQueryResult] = {}
+        if to_retrieve:
+            try:
+                batch_results = await self.db_manager.ahybrid_query_batch(
+                    [batch_queries[i] for i in to_retrieve],
+                    [embeddings[i] for i in to_retrieve],
+                    top_k=HYBRID_TOP_K,
+                    alpha=HYBRID_ALPHA,
+                    query_filter=self.db_manager.active_filter()
+                )
+                retrieved = dict(zip(to_retrieve, batch_results))
+            except Exception as e:
+                # Per-question retrieval below still works
+                print(f"Batch Retrieval Failed: {e}")
+
+        # 4. Postprocessing + synthesis per question, concurrently (bounded)
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def _answer(i: int, normalized_query: str, query_embedding: List[float]) -> Dict[str, Any]:
+            if similar[i] is not None:
+                return similar[i]
+            async with semaphore:
+                try:
+                    bundle = QueryBundle(query_str=normalized_query, embedding=query_embedding)
+                    if i in retrieved:
+                        nodes = await self.query_engine._async_apply_node_postprocessors(
+                            _to_candidates(retrieved[i]), query_bundle=bundle
+                        )
+                        response = await self.query_engine.asynthesize(bundle, nodes)
+                    else:
+                        response = await self.query_engine.aquery(bundle)
+                    result = {
+                        "answer": str(response),
+                        "sources": self._parse_sources(response.source_nodes)
+                    }
+                except Exception as e:
+                    print(f"Query Failed: {e}")
+                    return error
+            answer_key = self._answer_key(normalized_query)
+            self.semantic_cache.put(answer_key, query_embedding, result, agrees=self._same_answer)
+            self.answer_cache.set(answer_key, result)
+            return result
+
+        answers = await asyncio.gather(
+            *(_answer(i, q, emb) for i, (q, emb) in enumerate(zip(batch_queries, embeddings)))
+        )
+        for normalized_query, answer in zip(batch_queries, answers):
+            for pos in pending[normalized_query]:
+                results[pos] = answer
+        return results
+
+    def search(self, query_term: str, target_sops: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Keyword search over Active SOPs: every SOP with a chunk containing at least one term,
+        best BM25 score first. `target_sops` caps the result (None = all matching SOPs).
+        """
+        filtered_terms = self._extract_search_terms(query_term)
+        if not filtered_terms:
+            return []
+
+        # 1a. Known miss: none of the terms occurs anywhere in the corpus -> no Qdrant round-trip
+        if self._known_miss(filtered_terms):
+            print(">>> No search term occurs in the indexed SOPs.")
+            return []
+
+        # 1b. Result cache: "gmp deviation" and "Deviation, GMP?" share one entry
+        cache_key = self._search_key(filtered_terms, target_sops)
+        cached = self.search_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        try:
+            # 2. RETRIEVE CANDIDATES (Sparse/BM25)
+            # We use BM25 to rank candidates; Qdrant only returns chunks containing these words
+            cleaned_query_str = " ".join(re.escape(t) for t in filtered_terms)
+            result = self._ctx.vector_store.query(
+                self._sparse_query(cleaned_query_str),
+                qdrant_filters=self._ctx.keyword_filter(filtered_terms)
+            )
+            candidate_nodes = _to_candidates(result)
+
+            results = self._collect_search_results(candidate_nodes, filtered_terms, target_sops)
+            self.search_cache.set(cache_key, results)
+            return results
+
+        except Exception as e:
+            print(f"Search Failed: {e}")
+            return []
+
+    async def _asearch(self, query_term: str, target_sops: Optional[int] = None) -> List[Dict[str, Any]]:
+        """search() on the AsyncQdrantClient (runs on the engine loop)."""
+        filtered_terms = self._extract_search_terms(query_term)
+        if not filtered_terms:
+            return []
+
+        # 1a. Known miss: none of the terms occurs anywhere in the corpus -> no Qdrant round-trip
+        if self._known_miss(filtered_terms):
+            print(">>> No search term occurs in the indexed SOPs.")
+            return []
+
+        cache_key = self._search_key(filtered_terms, target_sops)
+        cached = self.search_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        try:
+            cleaned_query_str = " ".join(re.escape(t) for t in filtered_terms)
+            result = await self._ctx.vector_store.aquery(
+                self._sparse_query(cleaned_query_str),
+                qdrant_filters=self._ctx.keyword_filter(filtered_terms)
+            )
+            candidate_nodes = _to_candidates(result)
+
+            results = self._collect_search_results(candidate_nodes, filtered_terms, target_sops)
+            self.search_cache.set(cache_key, results)
+            return results
+
+        except Exception as e:
+            print(f"Search Failed: {e}")
+            return []
+
+    def _sparse_query(self, query_str: str) -> VectorStoreQuery:
+        return VectorStoreQuery(
+            query_str=query_str,
+            similarity_top_k=self._ctx.top_k,
+            mode=VectorStoreQueryMode.SPARSE,
+            alpha=0.0
+        )
+
+    def _search_key(self, filtered_terms: List[str], target_sops: Optional[int]) -> str:
+        """Order-insensitive cache key for search(): index version + result size + sorted terms."""
+        version = self.db_manager.index_version.get()
+        return f"v{version}|{'all' if target_sops is None else target_sops}|{' '.join(sorted(filtered_terms))}"
+
+    def _extract_search_terms(self, query_term: str) -> List[str]:
+        """
+        Lowercases the query, strips punctuation and drops stop words.
+        Returns an empty list when nothing searchable is left.
+        """
+        if not query_term.strip():
+            return []
+
+        print(f">>> Performing Broad Multi-Keyword Search for: '{query_term}'")
+
         
         # --- 2. CLEAN THE QUERY ---
-        # A. Lowercase
-        cleaned_query = query_term.lower()
-            
-        # B. Remove Punctuation (replace with space)
+        # A. Lowercase + B. Remove Punctuation (replace with space), one translate() pass
         # e.g. "glove,safety" -> "glove safety"
-        for char in string.punctuation:
-            cleaned_query = cleaned_query.replace(char, " ")
+        cleaned_query = fold_case(query_term).translate(self._ctx.punct_table)
                 
         # C. Split and Filter Stop Words
         raw_terms = cleaned_query.split()
 
         # Keep term ONLY if it is NOT in stop_words
+        stop_words = self._ctx.stop_words
         filtered_terms = [t for t in raw_terms if t not in stop_words]
         
         # # Fallback: If user typed ONLY stop words (e.g., "The and"), keep original to avoid empty search
@@ -280,101 +1009,118 @@ class FASAEngine:
             return []
 
         print(f">>> Cleaned Search Terms: {filtered_terms}")
-
-        try:
-            # Escape them to handle special chars like '+', '?' safely
-            safe_terms = [re.escape(t) for t in filtered_terms]
-            
-            # Pattern to find ANY of the words (Used for both filtering and highlighting)
-            # regex structure: \b(word1|word2|word3)\b (OR Logic)
-            highlight_pattern = re.compile(rf"\b({'|'.join(safe_terms)})\b", re.IGNORECASE)
-
-            # 2. RETRIEVE CANDIDATES (Sparse/BM25)
-            # We use BM25 to get candidates that contain these words
-            active_filter = MetadataFilters(
-                filters=[MetadataFilter(key="status", value="Active")]
+        return filtered_terms
+
+    def _collect_search_results(
+        self, candidate_nodes: List[NodeWithScore], filtered_terms: List[str], target_sops: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Scans retrieved candidates for the search terms and groups hits per SOP.
+        Returns the `target_sops` best SOPs (all when None); snippets are only cut for those.
+        """
+        term_key = tuple(sorted(set(filtered_terms)))
+
+        first_hit, has_hit = self._ctx.matchers(term_key)
+
+        # Score prefilter (NumPy): drop near-zero BM25 hits and visit the rest best-first,
+        # so the regex scan below only runs on candidates that can make the results.
+        # 0.05 is search()'s own floor (the Q&A engine has no Python-side score cutoff).
+        # float64 = the scores exactly as Qdrant returned them (no rounding at the boundary).
+        scores = np.fromiter(
+            (n.score or 0.0 for n in candidate_nodes), dtype=np.float64, count=len(candidate_nodes)
+        )
+        order = np.argsort(-scores, kind="stable")
+        keep = order[scores[order] >= 0.05]
+
+        # Columnar view of the kept candidates (SoA): every metadata field is read once here,
+        # and the scan loop below just walks parallel lists.
+        metas = [candidate_nodes[i].node.metadata for i in keep]
+        texts = [m.get("original_text", candidate_nodes[i].node.text) for m, i in zip(metas, keep)]
+        # Case-folded, newline-normalised copy (precomputed at ingest; same offsets as the text)
+        scans = [m.get("_scan") for m in metas]
+        srcs = [
+            m.get("_src") or (
+                m.get("sop_title", "Unknown SOP"),
+                m.get("file_name", "Unknown File"),
+                m.get("page_label", "?")
             )
+            for m in metas
+        ]
+        body_offs = [m.get("_body_off") for m in metas]
+        kept_scores = scores[keep]
+
+        # 3. FILTER: one matcher pass per candidate, best-first
+        hits = []
+        for k, text_to_scan in enumerate(texts):
+            scan_text = scans[k]
+            if scan_text is None:
+                scan_text = scans[k] = fold_case(text_to_scan).translate(_NL_TABLE)
+
+            # --- FLEXIBLE "OR" LOGIC ---
+            # Keep the candidate if the matcher finds AT LEAST ONE of the words.
+            if has_hit(scan_text):
+                hits.append(k)
+
+        if not hits:
+            print(">>> Broad Search Complete. Found matches in 0 SOPs.")
+            return []
 
-            broad_retriever = self.index.as_retriever(
-                similarity_top_k=100,
-                vector_store_query_mode="sparse", 
-                alpha=0.0,
-                filters=active_filter 
+        # 4. GROUP PER SOP (NumPy on parallel arrays)
+        # Group codes are assigned in first-seen order. Candidates are visited best-first, so
+        # code order is already "highest score first" and a group's first hit holds its max score.
+        group_of: Dict[str, int] = {}
+        codes = np.fromiter(
+            (group_of.setdefault(srcs[k][0], len(group_of)) for k in hits), dtype=np.intp, count=len(hits)
+        )
+        match_counts = np.bincount(codes)
+        _, group_first = np.unique(codes, return_index=True)
+        first_cand = np.asarray(hits)[group_first]
+        highest_scores = kept_scores[first_cand]
+        top = len(group_of) if target_sops is None else min(target_sops, len(group_of))
+
+        # 5. SNIPPETS: only for the `top` SOPs that will be returned (MAX_SNIPPETS each)
+        snippets: List[List[str]] = [[] for _ in range(top)]
+        full_groups = 0
+        for k, code in zip(hits, codes.tolist()):
+            if code >= top or len(snippets[code]) >= MAX_SNIPPETS:
+                continue
+            text_to_scan = texts[k]
+            page_label = srcs[k][2]
+
+            # Clean text for snippet presentation (skip the "Source: ..." header line)
+            body_off = body_offs[k]
+            if body_off is None:
+                # Nodes indexed before '_body_off' existed
+                body_off = text_to_scan.find("\n") + 1 if "Source:" in text_to_scan else 0
+
+            # Match on the pre-folded text from the body on, then slice the cased text at the
+            # same offsets (a few positioned lookups, no full hit iteration).
+            norm_text = text_to_scan.translate(_NL_TABLE)
+            windows = _snippet_windows(first_hit, scans[k], MAX_SNIPPETS - len(snippets[code]), body_off)
+            snippets[code].extend(
+                f"• (Pg {page_label}) ...{norm_text[start:end]}..." for start, end in windows
             )
-
-            cleaned_query_str = " ".join(safe_terms)
-            
-            candidate_nodes = broad_retriever.retrieve(cleaned_query_str)
-            
-            sop_grouping = {}
-
-            # 3. FILTER & PROCESS
-            for node_w_score in candidate_nodes:
-                node = node_w_score.node
-                meta = node.metadata
-                
-                text_to_scan = meta.get("original_text", node.text)
-                
-                # --- FLEXIBLE "OR" LOGIC ---
-                # We simply check if the regex finds AT LEAST ONE of the words.
-                if not highlight_pattern.search(text_to_scan):
-                    continue  # Skip only if NONE of the words are found
-
-                # --- IF MATCH FOUND ---
-                sop_title = meta.get("sop_title", "Unknown SOP")
-                file_name = meta.get("file_name", "Unknown File")
-                page_label = meta.get("page_label", "?")
-
-                if sop_title not in sop_grouping:
-                    sop_grouping[sop_title] = {
-                        "file_name": file_name,
-                        "highest_score": node_w_score.score, 
-                        "match_count": 0,
-                        "snippets": []
-                    }
-                
-                group = sop_grouping[sop_title]
-                group["match_count"] += 1
-                
-                # Clean text for snippet presentation
-                clean_text = text_to_scan
-                if "Source:" in clean_text:
-                    parts = clean_text.split("\n", 1)
-                    if len(parts) > 1: clean_text = parts[1]
-
-                # Generate Snippets (Show context around found keywords)
-                if len(group["snippets"]) < 3:
-                    # Find occurrences of ANY keyword to create the snippet
-                    iterator = highlight_pattern.finditer(clean_text)
-                    for m in iterator:
-                        start = max(0, m.start() - 60)
-                        end = min(len(clean_text), m.end() + 60)
-                        snippet = clean_text[start:end].replace("\n", " ")
-                        
-                        group["snippets"].append(f"• (Pg {page_label}) ...{snippet}...")
-                        
-                        # Stop after 3 snippets to avoid clutter
-                        if len(group["snippets"]) >= 3: break
-
-            # 4. FORMAT OUTPUT
-            results = []
-            for title, data in sop_grouping.items():
-                results.append({
-                    "SOP Title": title,
-                    "File Name": data["file_name"],
-                    "Relevance": round(data["highest_score"], 3),
-                    "Matches Found": data["match_count"],
-                    "Snippets": "\n".join(data["snippets"])
-                })
-            
-            # Sort by relevance score (provided by BM25)
-            results.sort(key=lambda x: x["Relevance"], reverse=True)
-            print(f">>> Broad Search Complete. Found matches in {len(results)} SOPs.")
-            return results
-
-        except Exception as e:
-            print(f"Search Failed: {e}")
-            return []
+            if len(snippets[code]) >= MAX_SNIPPETS:
+                full_groups += 1
+                # EARLY EXIT: every returned SOP has its snippets
+                if full_groups == top:
+                    break
+
+        # 6. FORMAT OUTPUT (already sorted by relevance, i.e. the best BM25 score per SOP)
+        titles = list(group_of)
+        results = [
+            {
+                "SOP Title": titles[g],
+                "File Name": srcs[first_cand[g]][1],
+                "Relevance": round(float(highest_scores[g]), 3),
+                "Matches Found": int(match_counts[g]),
+                "Snippets": "\n".join(snippets[g])
+            }
+            for g in range(top)
+        ]
+        
+        print(f">>> Broad Search Complete. Found matches in {len(results)} SOPs.")
+        return results
 
 
 
@@ -588,105 +1334,105 @@ class FASAEngine:
 
 
 # OR
-def search(self, query_term: str) -> List[Dict[str, Any]]:
-        if not query_term.strip():
-            return []
-
-        print(f">>> Performing Broad Multi-Keyword Search for: '{query_term}'")
-        
-        try:
-            # 1. PREPARE TERMS
-            # Split query into individual words
-            # e.g., "safety gloves" -> ["safety", "gloves"]
-            raw_terms = query_term.strip().split()
-            # Escape them to handle special chars like '+', '?' safely
-            safe_terms = [re.escape(t) for t in raw_terms]
-            
-            # Pattern to find ANY of the words (Used for both filtering and highlighting)
-            # regex structure: \b(word1|word2|word3)\b (OR Logic)
-            highlight_pattern = re.compile(rf"\b({'|'.join(safe_terms)})\b", re.IGNORECASE)
-
-            # 2. RETRIEVE CANDIDATES (Sparse/BM25)
-            # We use BM25 to get candidates that contain these words
-            active_filter = MetadataFilters(
-                filters=[MetadataFilter(key="status", value="Active")]
-            )
-
-            broad_retriever = self.index.as_retriever(
-                similarity_top_k=100,
-                vector_store_query_mode="sparse", 
-                alpha=0.0,
-                filters=active_filter 
-            )
-            
-            candidate_nodes = broad_retriever.retrieve(query_term)
-            
-            sop_grouping = {}
-
-            # 3. FILTER & PROCESS
-            for node_w_score in candidate_nodes:
-                node = node_w_score.node
-                meta = node.metadata
-                
-                text_to_scan = meta.get("original_text", node.text)
-                
-                # --- FLEXIBLE "OR" LOGIC ---
-                # We simply check if the regex finds AT LEAST ONE of the words.
-                if not highlight_pattern.search(text_to_scan):
-                    continue  # Skip only if NONE of the words are found
-
-                # --- IF MATCH FOUND ---
-                sop_title = meta.get("sop_title", "Unknown SOP")
-                file_name = meta.get("file_name", "Unknown File")
-                page_label = meta.get("page_label", "?")
-
-                if sop_title not in sop_grouping:
-                    sop_grouping[sop_title] = {
-                        "file_name": file_name,
-                        "highest_score": node_w_score.score, 
-                        "match_count": 0,
-                        "snippets": []
-                    }
-                
-                group = sop_grouping[sop_title]
-                group["match_count"] += 1
-                
-                # Clean text for snippet presentation
-                clean_text = text_to_scan
-                if "Source:" in clean_text:
-                    parts = clean_text.split("\n", 1)
-                    if len(parts) > 1: clean_text = parts[1]
-
-                # Generate Snippets (Show context around found keywords)
-                if len(group["snippets"]) < 3:
-                    # Find occurrences of ANY keyword to create the snippet
-                    iterator = highlight_pattern.finditer(clean_text)
-                    for m in iterator:
-                        start = max(0, m.start() - 60)
-                        end = min(len(clean_text), m.end() + 60)
-                        snippet = clean_text[start:end].replace("\n", " ")
-                        
-                        group["snippets"].append(f"• (Pg {page_label}) ...{snippet}...")
-                        
-                        # Stop after 3 snippets to avoid clutter
-                        if len(group["snippets"]) >= 3: break
-
-            # 4. FORMAT OUTPUT
-            results = []
-            for title, data in sop_grouping.items():
-                results.append({
-                    "SOP Title": title,
-                    "File Name": data["file_name"],
-                    "Relevance": round(data["highest_score"], 3),
-                    "Matches Found": data["match_count"],
-                    "Snippets": "\n".join(data["snippets"])
-                })
-            
-            # Sort by relevance score (provided by BM25)
-            results.sort(key=lambda x: x["Relevance"], reverse=True)
-            print(f">>> Broad Search Complete. Found matches in {len(results)} SOPs.")
-            return results
-
-        except Exception as e:
-            print(f"Search Failed: {e}")
-            return []
\ No newline at end of file
+# def search(self, query_term: str) -> List[Dict[str, Any]]:
+#         if not query_term.strip():
+#             return []
+
+#         print(f">>> Performing Broad Multi-Keyword Search for: '{query_term}'")
+#
+#         try:
+#             # 1. PREPARE TERMS
+#             # Split query into individual words
+#             # e.g., "safety gloves" -> ["safety", "gloves"]
+#             raw_terms = query_term.strip().split()
+#             # Escape them to handle special chars like '+', '?' safely
+#             safe_terms = [re.escape(t) for t in raw_terms]
+#
+#             # Pattern to find ANY of the words (Used for both filtering and highlighting)
+#             # regex structure: \b(word1|word2|word3)\b (OR Logic)
+#             highlight_pattern = re.compile(rf"\b({'|'.join(safe_terms)})\b", re.IGNORECASE)
+
+#             # 2. RETRIEVE CANDIDATES (Sparse/BM25)
+#             # We use BM25 to get candidates that contain these words
+#             active_filter = MetadataFilters(
+#                 filters=[MetadataFilter(key="status", value="Active")]
+#             )
+
+#             broad_retriever = self.index.as_retriever(
+#                 similarity_top_k=100,
+#                 vector_store_query_mode="sparse", 
+#                 alpha=0.0,
+#                 filters=active_filter 
+#             )
+#
+#             candidate_nodes = broad_retriever.retrieve(query_term)
+#
+#             sop_grouping = {}
+
+#             # 3. FILTER & PROCESS
+#             for node_w_score in candidate_nodes:
+#                 node = node_w_score.node
+#                 meta = node.metadata
+#
+#                 text_to_scan = meta.get("original_text", node.text)
+#
+#                 # --- FLEXIBLE "OR" LOGIC ---
+#                 # We simply check if the regex finds AT LEAST ONE of the words.
+#                 if not highlight_pattern.search(text_to_scan):
+#                     continue  # Skip only if NONE of the words are found
+
+#                 # --- IF MATCH FOUND ---
+#                 sop_title = meta.get("sop_title", "Unknown SOP")
+#                 file_name = meta.get("file_name", "Unknown File")
+#                 page_label = meta.get("page_label", "?")
+
+#                 if sop_title not in sop_grouping:
+#                     sop_grouping[sop_title] = {
+#                         "file_name": file_name,
+#                         "highest_score": node_w_score.score, 
+#                         "match_count": 0,
+#                         "snippets": []
+#                     }
+#
+#                 group = sop_grouping[sop_title]
+#                 group["match_count"] += 1
+#
+#                 # Clean text for snippet presentation
+#                 clean_text = text_to_scan
+#                 if "Source:" in clean_text:
+#                     parts = clean_text.split("\n", 1)
+#                     if len(parts) > 1: clean_text = parts[1]
+
+#                 # Generate Snippets (Show context around found keywords)
+#                 if len(group["snippets"]) < 3:
+#                     # Find occurrences of ANY keyword to create the snippet
+#                     iterator = highlight_pattern.finditer(clean_text)
+#                     for m in iterator:
+#                         start = max(0, m.start() - 60)
+#                         end = min(len(clean_text), m.end() + 60)
+#                         snippet = clean_text[start:end].replace("\n", " ")
+#
+#                         group["snippets"].append(f"• (Pg {page_label}) ...{snippet}...")
+#
+#                         # Stop after 3 snippets to avoid clutter
+#                         if len(group["snippets"]) >= 3: break
+
+#             # 4. FORMAT OUTPUT
+#             results = []
+#             for title, data in sop_grouping.items():
+#                 results.append({
+#                     "SOP Title": title,
+#                     "File Name": data["file_name"],
+#                     "Relevance": round(data["highest_score"], 3),
+#                     "Matches Found": data["match_count"],
+#                     "Snippets": "\n".join(data["snippets"])
+#                 })
+#
+#             # Sort by relevance score (provided by BM25)
+#             results.sort(key=lambda x: x["Relevance"], reverse=True)
+#             print(f">>> Broad Search Complete. Found matches in {len(results)} SOPs.")
+#             return results
+
+#         except Exception as e:
+#             print(f"Search Failed: {e}")
+#             return []
\ No newline at end of file
@@ -0,0 +1,60 @@
+import string
+import unicodedata
+from functools import lru_cache
+
+# =================================================================================================
+
+# Words that carry no question on their own ("what is this?", "can you help me?").
+# Deliberately NOT the keyword-search stop list: that one also drops SOP content words
+# (low, high, use, daily, before, ...) that are perfectly good Q&A questions.
+_FILLER_WORDS = frozenset({
+    "a", "an", "the", "this", "that", "these", "those",
+    "i", "me", "my", "we", "us", "our", "you", "your", "it", "its", "they", "them", "their",
+    "is", "am", "are", "was", "were", "be", "been", "do", "does", "did", "have", "has", "had",
+    "can", "could", "will", "would", "shall", "should", "may", "might", "must",
+    "what", "which", "who", "whom", "whose", "when", "where", "why", "how",
+    "and", "or", "but", "if", "so", "of", "to", "in", "on", "at", "by", "for", "with", "about",
+    "not", "no", "yes", "ok", "okay", "please", "hi", "hello", "hey", "thanks", "thank",
+    "help", "tell", "explain", "question",
+})
+
+# Punctuation -> space table
+_PUNCT_TRANS = str.maketrans({c: " " for c in string.punctuation})
+
+
+@lru_cache(maxsize=8192)
+def normalize_text(text: str) -> str:
+    """
+    Canonical form of a user query, used as the cache key and as the text sent to the RAG pipeline.
+    NFKC (composed vs. decomposed accents, full-width forms), lowercase, whitespace collapsed:
+    "  Revisión   GMP " and "revisión gmp" map to the same string.
+    Memoized: repeated questions (and the cache-key lookups for them) skip the work entirely.
+    """
+    # ASCII is already NFKC-normal: skip the Unicode pass for the common case
+    if not text.isascii():
+        text = unicodedata.normalize("NFKC", text)
+    # split()/join() collapses the same whitespace as re.sub(r"\s+") in one C-level pass
+    return " ".join(text.lower().split())
+
+
+def fold_case(text: str) -> str:
+    """
+    str.lower() that never changes the length, so offsets found in the folded text are valid in
+    the original. The few characters whose lowercase is longer ("İ" -> "i̇") are kept as they are.
+    """
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return "".join(c if len(low := c.lower()) != 1 else low for c in text)
+
+
+@lru_cache(maxsize=4096)
+def is_trivial_query(normalized_query: str) -> bool:
+    """
+    True for input not worth an embedding/Qdrant/LLM round-trip: empty, punctuation only, or
+    nothing but filler words ("what is this?"). Length alone is no signal ("QC", "5S" are real
+    questions). Takes the normalize_text() form; memoized, so a repeated no-op question is
+    rejected with a dict lookup.
+    """
+    words = normalized_query.translate(_PUNCT_TRANS).split()
+    return all(w in _FILLER_WORDS for w in words)
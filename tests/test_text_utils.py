@@ -0,0 +1,46 @@
+import pytest
+
+from src.text_utils import normalize_text, is_trivial_query, fold_case
+
+
+@pytest.mark.parametrize("query", [
+    "",
+    "   ",
+    "ok",
+    "?!",
+    "???",
+    "...",
+    "What is this?",
+    "Can you help me?",
+    "hello",
+    "the of and",
+])
+def test_trivial_queries_are_rejected(query):
+    assert is_trivial_query(normalize_text(query))
+
+
+@pytest.mark.parametrize("query", [
+    "CAPA",
+    "QC",
+    "QA",
+    "5S",
+    "gmp",
+    "deviation",
+    "What should I do if it is low?",
+    "When do we use it?",
+    "What happens before and after cleaning?",
+    "How often is the daily check?",
+    "What is the CAPA process?",
+    "Revisión GMP",
+])
+def test_real_questions_are_accepted(query):
+    assert not is_trivial_query(normalize_text(query))
+
+
+@pytest.mark.parametrize("text", ["GMP Deviation", "İstanbul SOP", "Straße", "ÀÉÎ"])
+def test_fold_case_keeps_offsets(text):
+    folded = fold_case(text)
+    assert len(folded) == len(text)
+    # Every character is lowercased unless its lowercase form is longer than one code point
+    for original, char in zip(text, folded):
+        assert char == original.lower() or len(original.lower()) != 1